@@ -1,74 +1,16 @@
-import csv
 import argparse
+import contextlib
 import sys
-import re
-import ipaddress
 import os
-import shutil
-import math
 import time
+import json
+from kgzcfglib import (version, supported_model_list, is_numeric, is_valid_ip, is_valid_subnet_mask, is_in_list,
+                       mac_processing, iter_mac_file, MacTable, get_site_paths, run_site, load_job_file, run_jobs, KgzcfgError,
+                       ProgressReporter, StageProfiler, format_job_result, serve_jobs, submit_jobs, serve_http,
+                       serve_provisioning)
 
-version = "1.0.7.2" # Version of the script
-
-# Variables for storing input parameters
-export_zero_config_csv_file_path = ""
-mac_addresses = []
-model = ""
-ucm_ip = ""
-start_ip = ""
-subnet_mask = ""
-gateway_ip = ""
-dns_ip = ""
-start_account = ""
-ip_mode = ""
 loading_time = 0.01 # Time delay for the loading effect
-
-# Function to check if input is numeric
-def is_numeric(input_str):
-    return re.match(r"^\d{2,}$", input_str) is not None
-
-# Function to validate if the input is a valid IP address
-def is_valid_ip(ip):
-    ip_pattern = re.compile(r"^(25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)\."
-                            r"(25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)\."
-                            r"(25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)\."
-                            r"(25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)$") # Regular expression for IPv4
-    return bool(ip_pattern.match(ip))  # Return True if valid, False otherwise
-
-# Function to validate subnet mask input
-def is_valid_subnet_mask(subnet_mask):
-    try:
-        subnet = ipaddress.IPv4Network(f"0.0.0.0/{subnet_mask}", strict=False)  # Parse subnet mask
-        return not subnet.with_prefixlen.endswith('/0')  # Ensure the subnet is valid
-    except ValueError:
-        return False
-
-# Regular expression to match valid MAC addresses (with or without colons or dashes)
-mac_pattern = re.compile(r'([0-9A-Fa-f]{2}[:\-]?[0-9A-Fa-f]{2}[:\-]?[0-9A-Fa-f]{2}[:\-]?[0-9A-Fa-f]{2}[:\-]?[0-9A-Fa-f]{2}[:\-]?[0-9A-Fa-f]{2})')
-
-# Function to check if a MAC address is valid
-def is_valid_mac(mac):
-    # Remove any separators (colons or dashes)
-    cleaned_mac = mac.replace(":", "").replace("-", "").upper()
-    # Check if the MAC address has exactly 12 hexadecimal characters and isn't a repeating sequence
-    if len(cleaned_mac) == 12 and re.match(r'^[0-9A-F]{12}$', cleaned_mac):
-        if len(set(cleaned_mac)) > 1:  # Rejects all same-character addresses like '111111111111'
-            return True
-    return False
-
-# Function to process the MAC addresses found in the file or input
-def mac_processing(found_macs):
-    valid_macs = []
-    invalid_macs = []
-
-    for mac in found_macs:
-        formatted_mac = mac.replace(":", "").replace("-", "").upper()
-        if is_valid_mac(formatted_mac):
-            valid_macs.append(formatted_mac)
-        else:
-            invalid_macs.append(mac)
-
-    return valid_macs, invalid_macs
+plan_stdout = sys.stdout  # Stream the plan of --plan-json - is written to
 
 # Function to prompt the user for MAC addresses if no file is found or valid MACs are present
 def get_user_mac_input():
@@ -81,126 +23,6 @@ def get_user_mac_input():
         else:
             print("No valid MAC addresses found. Please try again.")
 
-# Check if a given value exists in a list
-def is_in_list(input_value, my_list):
-    return input_value in my_list
-
-# List of supported phone models
-supported_model_list = ["GHP610", "GHP610W", "GHP611", "GHP611W", "GHP620", "GHP620W", "GHP621", "GHP621W", "GHP630", "GHP630W", "GHP631", "GHP631W", "GRP2601", "GRP2601P", "GRP2601W", "GRP2602", "GRP2602G", "GRP2602P", "GRP2602W", "GRP2603", "GRP2603P", "GRP2604", "GRP2604P", "GRP2612", "GRP2612G", "GRP2612P", "GRP2612W", "GRP2613", "GRP2614", "GRP2615", "GRP2616", "GRP2624", "GRP2634", "GRP2636", "GRP2650", "GRP2670", "GSC3505", "GSC3506", "GSC3510", "GSC3516", "GSC3570", "GSC3574", "GSC3575", "GSC3610", "GSC3615", "GSC3620", "GXP1100", "GXP1105", "GXP1600C", "GXP1610C", "GXP1610P", "GXP1615", "GXP1628B", "GXP1760", "GXP1760W", "GXP1780", "GXP1782", "GXP2130", "GXP2135", "GXP2136", "GXP2140", "GXP2160", "GXP2170", "GXV3240", "GXV3275", "GXV3350", "GXV3370", "GXV3380", "GXV3450", "GXV3470", "GXV3480", "GXV3500", "WP800", "WP810", "WP816", "WP820", "WP822", "WP825", "WP826", "WP856",]
-
-# Argument parser setup for command-line inputs
-parser = argparse.ArgumentParser(description="karan's grandstream zero configuration file generator")
-parser.add_argument("-v", action="store_true", help="Print version info")
-parser.add_argument("-m", help="IP Phone Model")
-parser.add_argument("-u", help="UCM IP Address")
-parser.add_argument("-s", help="Starting IP Address")
-parser.add_argument("-n", help="Subnet Mask")
-parser.add_argument("-g", help="Gateway IP Address")
-parser.add_argument("-a", help="Starting Account")
-parser.add_argument("-d", help="DNS IP Address")
-parser.add_argument("-i", type=int, help="IP Phones mode")
-
-# Parse the command-line arguments
-args = parser.parse_args()
-
-# Handle version argument
-if args.v:
-    print("\nkgzcfg version: {}".format(version))
-    sys.exit(0)
-
-# Model input validation
-if args.m:
-    check = args.m.upper()
-    if is_in_list(check, supported_model_list):
-        model = args.m.upper()
-
-if args.u:
-    if is_valid_ip(args.u):
-        ucm_ip = args.u
-
-if args.s:
-    if is_valid_ip(args.s):
-        start_ip = args.s
-
-if args.n:
-    try:
-        if int(args.n) <= 32:
-            print("Invalid IP address. Please enter a valid Subnet Mask.")
-    except:
-        if is_valid_subnet_mask(args.n):
-            subnet_mask = args.n
-
-if args.g:
-    if is_valid_ip(args.g):
-        gateway_ip = args.g
-
-if args.a:
-    if is_numeric(args.a):
-        start_account = int(args.a)
-
-if args.d:
-    if is_valid_ip(args.d):
-        dns_ip = args.d
-
-if args.i:
-    if args.i in (1, 2):
-        ip_mode = args.i
-
-# Function to get the configuration file paths
-def get_config_file(project):
-    kgzcfg = "kgzcfg"
-    script_directory = os.getcwd()  # Get the current script directory
-    folder_path = os.path.join(script_directory, kgzcfg, project)  # Set folder path based on project name
-    
-    # Create the directory if it doesn't exist
-    if not os.path.exists(folder_path):
-        os.makedirs(folder_path)
-        print(f"Folder '{folder_path}' created successfully.")
-    else:
-        print(f"Folder '{folder_path}' already exists.")
-
-    # Set file paths for output files
-    export_zero_config_csv_file_name = "kgzcfg_export_zc_devices.csv"
-    mac_file_name = "mac.txt"
-    deployment_file_name = "deployment-details.csv"
-    account_file_name = "account.txt"
-
-    export_zero_config_csv_file_path = os.path.join(folder_path, export_zero_config_csv_file_name)  # Full path for config file
-    mac_file_path = os.path.join(script_directory, kgzcfg, mac_file_name)  # Path for MAC address file
-    deployment_file_path = os.path.join(folder_path, deployment_file_name)  # Path for deployment file
-    account_file_path = os.path.join(script_directory, kgzcfg, account_file_name)  # Path for MAC address file
-    
-    # Open files or create them if they don't exist
-    try:
-        with open(export_zero_config_csv_file_path, "r") as file:
-            # Process the data as needed
-            print(f"Found existing '{export_zero_config_csv_file_name}' in the '{project}' folder as the script.")
-        with open(deployment_file_path, "r") as file:
-            # Process the data as needed
-            print(f"Found existing '{deployment_file_name}' in the '{project}' folder as the script.")    
-    except FileNotFoundError:
-        # If the file doesn't exist, create it
-        with open(export_zero_config_csv_file_path, "w") as file:
-            # Initialize the file content (if required)
-            print(f"Created '{export_zero_config_csv_file_name}' in the '{project}' folder as the script.")
-        with open(deployment_file_path, "w") as file:
-            # Process the data as needed
-            print(f"Created '{deployment_file_name}' in the '{project}' folder as the script.")                
-    finally:
-        return (export_zero_config_csv_file_path, mac_file_path, deployment_file_path, account_file_path)
-
-# Function to display a progress bar
-def progress_bar(progress, total):
-    percent = 100 * (progress / float(total))
-    terminal_width, _ = shutil.get_terminal_size()
-    if terminal_width > 72:
-        terminal_width = 72
-
-    bar_width = int((terminal_width - 10) * (percent / 100))
-    bar = '#' * bar_width + '-' * (terminal_width - 10 - bar_width)
-
-    print(f"\r|{bar}| {percent:.2f}%", end="\r")
-
 # ASCII logo used in the script
 logo = [
     ".--------------------------------------------------------------.",
@@ -235,135 +57,168 @@ def loading():
     #clear()  # Clear the terminal screen
     logo_loading()  # Show the ASCII logo with a loading effect
 
-def generate_ip_range(start_ip, count):
-    base_ip = start_ip.split('.')
-    base_ip[-1] = str(int(base_ip[-1]) - 1)  # Decrement last octet by 1 to start correctly
-    ips = []
-    for i in range(count):
-        base_ip[-1] = str(int(base_ip[-1]) + 1)  # Increment last octet
-        ips.append('.'.join(base_ip))
-    return ips
-
-def generate_account_numbers(start_account, count):
-    return [start_account + i for i in range(count)]
-
-def create_dhcp_config(mac, account, model, ucm_ip):
-    return {
-        "device_start": [
-            "======== Device Start ========",
-            "mac,model,ip,file_url,version,vendor,url_parameter,config_name,account_secret,state,ad_state,port,hot_desking,last_access",
-            f"{mac},{model},0.0.0.0,https://{ucm_ip}:8089/zccgi/,1.0.5.58,Grandstream,,,,8,0,5060,no,2024-07-27 16:08:27",
-            "",
-        ],
-        "basic_settings": [
-            "######## Basic Settings ########",
-            "mac,element,element_number,entity_name,value",
-            f"{mac},Account,1,AccountChoice,{account}",
-            "",
-        ]
-    }
-    
-def create_static_config(mac, ip, account, model, dns_ip, subnet_mask, gateway_ip, ucm_ip):
-    return {
-        "device_start": [
-            "======== Device Start ========",
-            "mac,model,ip,file_url,version,vendor,url_parameter,config_name,account_secret,state,ad_state,port,hot_desking,last_access",
-            f"{mac},{model},{ip},https://{ucm_ip}:8089/zccgi/,1.0.5.58,Grandstream,,,,8,0,5060,no,2024-07-27 16:08:27",
-            "",
-        ],
-        "basic_settings": [
-            "######## Basic Settings ########",
-            "mac,element,element_number,entity_name,value",
-            f"{mac},Account,1,AccountChoice,{account}",
-            "",
-        ],
-        "advanced_settings": [
-            "******** Advanced Settings ********",
-            "mac,field_name,element_number,entity_name,value",
-            f"{mac},IPAddressMode,1,AddressMode,1",
-            f"{mac},IPAddressMode,1,DNSAddressType,0",
-            f"{mac},IPAddressMode,1,DNSServer1_1,{dns_ip.split('.')[0]}",
-            f"{mac},IPAddressMode,1,DNSServer1_2,{dns_ip.split('.')[1]}",
-            f"{mac},IPAddressMode,1,DNSServer1_3,{dns_ip.split('.')[2]}",
-            f"{mac},IPAddressMode,1,DNSServer1_4,{dns_ip.split('.')[3]}",
-            f"{mac},IPAddressMode,1,DNSServer2_1,{gateway_ip.split('.')[0]}",
-            f"{mac},IPAddressMode,1,DNSServer2_2,{gateway_ip.split('.')[1]}",
-            f"{mac},IPAddressMode,1,DNSServer2_3,{gateway_ip.split('.')[2]}",
-            f"{mac},IPAddressMode,1,DNSServer2_4,{gateway_ip.split('.')[3]}",
-            f"{mac},IPAddressMode,1,Gateway_1,{gateway_ip.split('.')[0]}",
-            f"{mac},IPAddressMode,1,Gateway_2,{gateway_ip.split('.')[1]}",
-            f"{mac},IPAddressMode,1,Gateway_3,{gateway_ip.split('.')[2]}",
-            f"{mac},IPAddressMode,1,Gateway_4,{gateway_ip.split('.')[3]}",
-            f"{mac},IPAddressMode,1,StaticIP_1,{ip.split('.')[0]}",
-            f"{mac},IPAddressMode,1,StaticIP_2,{ip.split('.')[1]}",
-            f"{mac},IPAddressMode,1,StaticIP_3,{ip.split('.')[2]}",
-            f"{mac},IPAddressMode,1,StaticIP_4,{ip.split('.')[3]}",
-            f"{mac},IPAddressMode,1,SubnetMask_1,{subnet_mask.split('.')[0]}",
-            f"{mac},IPAddressMode,1,SubnetMask_2,{subnet_mask.split('.')[1]}",
-            f"{mac},IPAddressMode,1,SubnetMask_3,{subnet_mask.split('.')[2]}",
-            f"{mac},IPAddressMode,1,SubnetMask_4,{subnet_mask.split('.')[3]}",
-            "",
-        ]
-    }
-
-def append_config_to_csv(export_zero_config_csv_file_path, configs):
-    with open(export_zero_config_csv_file_path, mode='a', newline='') as file:
-        writer = csv.writer(file)
-        for config in configs:
-            for section, rows in config.items():
-                for row in rows:
-                    writer.writerow(row.split(','))
-
-def main(mac_addresses, model, ucm_ip, start_ip, subnet_mask, gateway_ip, dns_ip, start_account, ip_mode, loading_time):
-    loading()
-    total_steps = 100
-    progress_bar(0, total_steps)
-    
-    # Simulate a task that takes time (e.g., reading files, processing data, etc.)
-    for i in range(total_steps):
-        time.sleep(loading_time)  # Simulating work (replace with real task)
-        progress_bar(i + 1, total_steps)
-    print()  # Print a newline after completion    
-    print()  # Print a newline after completion    
-    site = input("Enter Site Name > ")
-    path = get_config_file(site)
-    export_zero_config_csv_file_path, mac_file_path, deployment_file_path, account_file_path = path
+# Function to build the argument parser for the command-line inputs
+def build_parser():
+    parser = argparse.ArgumentParser(description="karan's grandstream zero configuration file generator")
+    parser.add_argument("-v", action="store_true", help="Print version info")
+    parser.add_argument("-m", help="IP Phone Model")
+    parser.add_argument("-u", help="UCM IP Address")
+    parser.add_argument("-s", help="Starting IP Address")
+    parser.add_argument("-n", help="Subnet Mask")
+    parser.add_argument("-g", help="Gateway IP Address")
+    parser.add_argument("-a", help="Starting Account")
+    parser.add_argument("-d", help="DNS IP Address")
+    parser.add_argument("-i", type=int, help="IP Phones mode")
+    parser.add_argument("-r", action="store_true", help="Re-provision MAC addresses already recorded in the MAC index")
+    parser.add_argument("--jsonl", action="store_true", help="Also write the deployment records to deployment-details.jsonl")
+    parser.add_argument("--xml", action="store_true", help="Also write a cfg<MAC>.xml provisioning file per device to the site's xml folder")
+    parser.add_argument("--file-url", metavar="URL", help="URL the devices fetch their config from instead of the UCM's zero config URL")
+    parser.add_argument("--fsync", choices=("none", "batch", "always"), default="none", help="When to fsync the deployment records")
+    parser.add_argument("--atomic", action="store_true", help="Write through a journal so an interrupted run can be resumed")
+    parser.add_argument("--upsert", action="store_true", help="Rewrite the changed devices of the site instead of appending duplicates")
+    parser.add_argument("--site", help="Site Name")
+    parser.add_argument("--plan", action="store_true", help="Show what an upsert of the site would change without writing anything")
+    parser.add_argument("--plan-json", metavar="FILE", help="Write the plan as JSON to FILE ('-' for stdout) without writing anything else")
+    parser.add_argument("--batch", metavar="JOB_FILE", help="Provision every site of a JSON or TOML job file without prompts")
+    parser.add_argument("--batch-report", metavar="FILE", help="Write the per-site results of --batch as JSON to FILE")
+    parser.add_argument("--profile", nargs="?", const="timers", metavar="cprofile,memory",
+                        help="Write stage timings to kgzcfg-profile.json in the site folder, with cProfile dumps and tracemalloc snapshots if listed")
+    parser.add_argument("--serve", metavar="SOCKET", help="Run as a daemon serving job requests on the Unix socket SOCKET")
+    parser.add_argument("--http", metavar="[HOST:]PORT", help="Serve the HTTP API on PORT, of 127.0.0.1 unless HOST is given")
+    parser.add_argument("--provision-server", metavar="[HOST:]PORT",
+                        help="Serve the devices' cfg<MAC>.xml files on PORT, of 0.0.0.0 unless HOST is given; -u is the UCM of devices with another --file-url")
+    parser.add_argument("--submit", metavar="SOCKET", help="Send the --batch job file to the daemon serving SOCKET")
+    parser.add_argument("--workers", type=int, default=1, help="Worker processes for large sites and --batch, 0 for one per CPU")
+    return parser
+
+# Function to parse the command-line arguments into the inputs of main, invalid values are dropped
+# so they are asked for interactively
+def parse_arguments(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    options = {}
+
+    # Handle version argument
+    if args.v:
+        print("\nkgzcfg version: {}".format(version))
+        sys.exit(0)
+
+    # Model input validation
+    if args.m:
+        check = args.m.upper()
+        if is_in_list(check, supported_model_list):
+            options["model"] = args.m.upper()
+
+    if args.u:
+        if is_valid_ip(args.u):
+            options["ucm_ip"] = args.u
+
+    if args.s:
+        if is_valid_ip(args.s):
+            options["start_ip"] = args.s
+
+    if args.n:
+        try:
+            if int(args.n) <= 32:
+                print("Invalid IP address. Please enter a valid Subnet Mask.")
+        except:
+            if is_valid_subnet_mask(args.n):
+                options["subnet_mask"] = args.n
+
+    if args.g:
+        if is_valid_ip(args.g):
+            options["gateway_ip"] = args.g
+
+    if args.a:
+        if is_numeric(args.a):
+            options["start_account"] = int(args.a)
+
+    if args.d:
+        if is_valid_ip(args.d):
+            options["dns_ip"] = args.d
+
+    if args.i:
+        if args.i in (1, 2):
+            options["ip_mode"] = args.i
+
+    if args.upsert and args.atomic:
+        parser.error("--upsert can't be combined with --atomic, upsert already replaces the export file atomically")
+
+    options["reprovision"] = args.r
+    options["write_jsonl"] = args.jsonl
+    options["write_xml"] = args.xml
+    options["fsync_policy"] = args.fsync
+    options["atomic"] = args.atomic
+    options["upsert"] = args.upsert
+    options["site_name"] = args.site or ""
+    options["plan"] = args.plan
+    options["plan_json_path"] = args.plan_json or ""
+    options["job_file_path"] = args.batch or ""
+    options["report_path"] = args.batch_report or ""
+    if args.submit and not args.batch:
+        parser.error("--submit needs the job file to send with --batch")
+    options["serve_socket"] = args.serve or ""
+    options["submit_socket"] = args.submit or ""
+    options["file_url"] = args.file_url or ""
+
+    # Function to split a [HOST:]PORT server address, host defaulting to default_host
+    def parse_address(flag, address, default_host):
+        if not address:
+            return ()
+        host, _, port = address.rpartition(":")
+        if not port.isdigit() or not 0 < int(port) < 65536:
+            parser.error(f"invalid {flag} address '{address}', use PORT or HOST:PORT")
+        return (host or default_host, int(port))
+
+    options["http_address"] = parse_address("--http", args.http, "127.0.0.1")
+    options["provision_address"] = parse_address("--provision-server", args.provision_server, "0.0.0.0")
+    options["profile"] = [option for option in (args.profile or "").split(",") if option]
+    unknown = [option for option in options["profile"] if option not in ("timers", "cprofile", "memory")]
+    if unknown:
+        parser.error(f"unknown --profile options: {', '.join(unknown)}")
+    options["workers"] = args.workers if args.workers > 0 else os.cpu_count() or 1
+    return options
+
+# Function to read the MAC addresses from mac.txt, asking for them when the file has none. The
+# bytes read are followed by progress.
+def read_mac_addresses(mac_file_path, progress):
+    mac_addresses = MacTable()
     try:
-        with open(mac_file_path, 'r') as file:
-            from_file_mac_addresses = []
-            for line in file:
-                found_macs = mac_pattern.findall(line.strip())
-                from_file_mac_addresses.extend(found_macs)
-            print("MAC addresses successfully read from mac.txt")
-
-            # Process the found MAC addresses
-            valid_macs, invalid_macs = mac_processing(from_file_mac_addresses)
-
-            if valid_macs:
-                print("\nValid MAC addresses:")
-                for mac in valid_macs:
-                    print(mac)
-                    mac_addresses.append(mac)
+        # Stream the MAC addresses from the file straight into mac_addresses
+        invalid_macs = []
+        found_valid = False
+        progress.start("Reading mac.txt", os.path.getsize(mac_file_path), "bytes")
+        for mac, valid in iter_mac_file(mac_file_path, on_read=progress.advance):
+            if valid:
+                if not found_valid:
+                    progress.log("\nValid MAC addresses:")
+                    found_valid = True
+                progress.log(mac)
+                mac_addresses.append(mac)
+            else:
+                invalid_macs.append(mac)
+        progress.finish()
+        print("MAC addresses successfully read from mac.txt")
+
+        if invalid_macs:
+            print("\nInvalid MAC addresses:")
+            for mac in invalid_macs:
+                print(mac)
+        print()
+        # If no valid MAC addresses found, ask the user for input
+        if not found_valid:
+            print("No valid MAC addresses found in the file.")
+            valid_macs, invalid_macs = get_user_mac_input()
+
+            print("\nValid MAC addresses from input:")
+            for mac in valid_macs:
+                print(mac)
+                mac_addresses.append(mac)
 
             if invalid_macs:
-                print("\nInvalid MAC addresses:")
+                print("\nInvalid MAC addresses from input:")
                 for mac in invalid_macs:
                     print(mac)
-            print()
-            # If no valid MAC addresses found, ask the user for input
-            if not valid_macs:
-                print("No valid MAC addresses found in the file.")
-                valid_macs, invalid_macs = get_user_mac_input()
-
-                print("\nValid MAC addresses from input:")
-                for mac in valid_macs:
-                    print(mac)
-                    mac_addresses.append(mac)
-
-                if invalid_macs:
-                    print("\nInvalid MAC addresses from input:")
-                    for mac in invalid_macs:
-                        print(mac)
 
     except FileNotFoundError:
         print(f"'{mac_file_path}' not found in the same folder as the script.")
@@ -378,43 +233,101 @@ def main(mac_addresses, model, ucm_ip, start_ip, subnet_mask, gateway_ip, dns_ip
             print("\nInvalid MAC addresses from input:")
             for mac in invalid_macs:
                 print(mac)
+    return mac_addresses
 
-    if ucm_ip == "":
-        while True:
-            ucm_ip = input("Enter the UCM IP address > ")
-            if is_valid_ip(ucm_ip):
-                if is_valid_subnet_mask(ucm_ip):
-                    print("Entered value is Subnet Mask not IP Addresss")
-                    continue
-                else:
-                    break
+# Function to prompt for an IPv4 address until a valid one that is not a subnet mask is entered
+def input_ip(prompt, default=""):
+    while True:
+        ip = input(prompt) or default
+        if is_valid_ip(ip):
+            if is_valid_subnet_mask(ip):
+                print("Entered value is Subnet Mask not IP Addresss")
+                continue
             else:
-                print("Invalid IP address. Please enter a valid IPv4 address.")
+                return ip
+        else:
+            print("Invalid IP address. Please enter a valid IPv4 address.")
+
+# Function to provision every site of a job file, printing one result line per site. With
+# submit_socket the sites are sent to the job daemon serving it instead of being run here.
+def run_batch(job_file_path, report_path="", workers=1, submit_socket=""):
+    try:
+        jobs = load_job_file(job_file_path)
+    except KgzcfgError as error:
+        print(error)
+        sys.exit(0)
+
+    if submit_socket:
+        try:
+            results = submit_jobs(submit_socket, {"sites": jobs})
+        except KgzcfgError as error:
+            print(error)
+            sys.exit(0)
+        for result in results:
+            print(format_job_result(result))
+    else:
+        print(f"Provisioning {len(jobs)} sites from '{job_file_path}'.")
+
+        # The sites' own messages are dropped, only their results are shown
+        def report_result(result):
+            progress.log(format_job_result(result))
+            progress.advance()
+
+        with ProgressReporter() as progress:
+            progress.start("Provisioning", len(jobs), "sites")
+            results = run_jobs(jobs, log=lambda *args: None, on_result=report_result, workers=workers)
+            progress.finish()
+    failed = sum(1 for result in results if result["status"] != "ok")
+    print(f"\n{len(results) - failed} sites provisioned, {failed} failed, {sum(result.get('devices', 0) for result in results)} devices written.")
+    if report_path:
+        with open(report_path, "w") as file:
+            json.dump(results, file, indent=2)
+        print(f"Results written to '{report_path}'.")
+
+def main(model="", ucm_ip="", start_ip="", subnet_mask="", gateway_ip="", dns_ip="", start_account="", ip_mode="", reprovision=False, write_jsonl=False, write_xml=False, file_url="", fsync_policy="none", atomic=False, upsert=False, site_name="", plan=False, plan_json_path="", job_file_path="", report_path="", workers=1, profile=(), serve_socket="", submit_socket="", http_address=(), provision_address=()):
+    if provision_address:
+        serve_provisioning(*provision_address, ucm_ip=ucm_ip)
+        return
+    if http_address:
+        serve_http(*http_address)
+        return
+    if serve_socket:
+        try:
+            serve_jobs(serve_socket, workers=workers)
+        except KgzcfgError as error:
+            print(error)
+        return
+    if job_file_path:
+        run_batch(job_file_path, report_path, workers, submit_socket)
+        return
+    loading()
+    print()
+    site = site_name or input("Enter Site Name > ")
+    paths = get_site_paths(site)
+    mac_file_path, account_file_path = paths[1], paths[3]
+    progress = ProgressReporter()
+    profiler = StageProfiler(cprofile="cprofile" in profile, memory="memory" in profile) if profile else None
+    if profiler:
+        profiler.begin("read_mac_file")
+    mac_addresses = read_mac_addresses(mac_file_path, progress)
+    if profiler:
+        profiler.end()
+
+    # Ask for the inputs that were not given on the command line
+    if ucm_ip == "":
+        ucm_ip = input_ip("Enter the UCM IP address > ")
     if model == "":
         while True:
             model = input("Enter the Model default (GRP2601P) > ") or "GRP2601P"
             model = model.upper()
             if is_in_list(model, supported_model_list):
                 break
-    accounts = []
-    try:
-        with open(account_file_path, 'r') as file:
-            print("Accounts successfully read from account.txt")
-            for line in file:
-                if is_numeric(line.strip()):
-                    accounts.append(line.strip())
-    except:
-        print(f"'{account_file_path}' not found in the same folder as the script.")
-        if start_account == "":
-            while True:
-                start_account = input("Enter the starting Account number > ")
-                if is_numeric(start_account):
-                    start_account = int(start_account)
-                    break
-        count = len(mac_addresses)
-        accounts = generate_account_numbers(start_account, count)
-    print(accounts)
-    print()
+    if start_account == "" and not os.path.exists(account_file_path):
+        while True:
+            start_account = input("Enter the starting Account number > ")
+            if is_numeric(start_account):
+                start_account = int(start_account)
+                break
     if ip_mode == "":
         while True: 
             ip_mode = input("Enter IP Phone network mode (1. DHCP 2. Static) > ")
@@ -423,16 +336,7 @@ def main(mac_addresses, model, ucm_ip, start_ip, subnet_mask, gateway_ip, dns_ip
     ip_mode = int(ip_mode)
     if ip_mode == 2:
         if start_ip == "":
-            while True:
-                start_ip = input("Enter the IP Phone starting IP address > ")
-                if is_valid_ip(start_ip):
-                    if is_valid_subnet_mask(start_ip):
-                        print("Entered value is Subnet Mask not IP Addresss")
-                        continue
-                    else:
-                        break
-                else:
-                    print("Invalid IP address. Please enter a valid IPv4 address.")
+            start_ip = input_ip("Enter the IP Phone starting IP address > ")
         if subnet_mask == "":
             while True:
                 print("Enter the Subnet Mask default (255.255.255.0) > ", end="")
@@ -448,64 +352,33 @@ def main(mac_addresses, model, ucm_ip, start_ip, subnet_mask, gateway_ip, dns_ip
                         print("Invalid IP address. Please enter a valid Subnet Mask.")
         default_gateway = start_ip.rsplit(".", 1)[0] + ".1"
         if gateway_ip == "":
-            while True:
-                print(f"Enter the Gateway IP address default ({default_gateway}) > ", end="")
-                gateway_ip = input() or default_gateway
-                if is_valid_ip(gateway_ip):
-                    if is_valid_subnet_mask(gateway_ip):
-                        print("Entered value is Subnet Mask not IP Addresss")
-                        continue
-                    else:
-                        break
-                else:
-                    print("Invalid IP address. Please enter a valid IPv4 address.")            
+            gateway_ip = input_ip(f"Enter the Gateway IP address default ({default_gateway}) > ", default_gateway)
         if dns_ip == "":
-            while True:                        
-                dns_ip = input("Enter the DNS IP address default (8.8.8.8) > ") or "8.8.8.8"
-                if is_valid_ip(dns_ip):
-                    if is_valid_subnet_mask(dns_ip):
-                        print("Entered value is Subnet Mask not IP Addresss")
-                        continue
-                    else:
-                        break
-                else:
-                    print("Invalid IP address. Please enter a valid IPv4 address.")            
-            
+            dns_ip = input_ip("Enter the DNS IP address default (8.8.8.8) > ", "8.8.8.8")
 
-    if ip_mode == 2:
-        ips = generate_ip_range(start_ip, count)
-
-    if not len(mac_addresses) == len(accounts):
-        print(f"Found number of MAC address and Account Number does not match. Numebr of MAC Address Found: {len(mac_addresses)} Number of Accounts Found: {len(accounts)}")
+    try:
+        with progress, contextlib.redirect_stdout(plan_stdout if plan_json_path == "-" else sys.stdout):
+            result = run_site(site, mac_addresses, model, ucm_ip, ip_mode, start_ip, subnet_mask, gateway_ip, dns_ip, start_account,
+                              reprovision, write_jsonl, fsync_policy, atomic, upsert, plan, plan_json_path, log=progress.log,
+                              workers=workers, progress=progress, profiler=profiler, write_xml=write_xml, file_url=file_url)
+    except KgzcfgError as error:
+        print(error)
         sys.exit(0)
+    if profiler:
+        # The stats go next to deployment-details.csv
+        stats_file_path = os.path.join(os.path.dirname(paths[2]), "kgzcfg-profile.json")
+        profiler.write(stats_file_path, site=site, devices=result["devices"], workers=workers)
+        print(f"Profile written to '{stats_file_path}'.")
+
+if __name__ == "__main__":
+    options = parse_arguments()
+    if options.get("plan_json_path") == "-":
+        # stdout only carries the plan JSON, everything else goes to stderr
+        plan_stdout, sys.stdout = sys.stdout, sys.stderr
+    try:
+        main(**options)
+    except:
+        print("\nkgzcfg Stop Executing.")
 
-    # Create config file with static ip address
-    if ip_mode == 2:
-        configs = [create_static_config(mac.strip(), ips[i], accounts[i], model, dns_ip, subnet_mask, gateway_ip, ucm_ip) for i, mac in enumerate(mac_addresses)]
-    if ip_mode == 1:
-        configs = [create_dhcp_config(mac.strip(), accounts[i], model, ucm_ip) for i, mac in enumerate(mac_addresses)]
-    
-    append_config_to_csv(export_zero_config_csv_file_path, configs)
-    
-    # Display assigned IP and account numbers
-    if ip_mode == 1:
-        print("\nAssigned MAC Address to Accounts:")
-        for i, mac in enumerate(mac_addresses):
-            print(f"MAC Address: {mac.strip()} - Account: {accounts[i]}")
-            with open(deployment_file_path, mode='a') as file:
-                file.write(f"MAC Address,{mac.strip()},Account,{accounts[i]}\n")
-    if ip_mode == 2:
-        print("\nAssigned IPs and Accounts:")
-        for i, mac in enumerate(mac_addresses):
-            print(f"MAC Address: {mac.strip()} - IP: {ips[i]} - Account: {accounts[i]}")
-            with open(deployment_file_path, mode='a') as file:
-                file.write(f"MAC Address,{mac.strip()},IP,{ips[i]},Account,{accounts[i]}\n")            
-
-try:
-    if __name__ == "__main__":
-        main(mac_addresses, model, ucm_ip, start_ip, subnet_mask, gateway_ip, dns_ip, start_account, ip_mode, loading_time)
-except:
-    print("\nkgzcfg Stop Executing.")
-
-finally:
-    print("\n[kgzcfg_v{}]:".format(version))
+    finally:
+        print("\n[kgzcfg_v{}]:".format(version))
@@ -0,0 +1,438 @@
+import argparse
+import collections
+import csv
+import itertools
+import json
+import os
+import platform
+import random
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import kgzcfglib as kgzcfg
+
+# MAC pattern used by kgzcfg before the byte-level scanner, kept here for comparison
+legacy_mac_pattern = re.compile(r'([0-9A-Fa-f]{2}[:\-]?[0-9A-Fa-f]{2}[:\-]?[0-9A-Fa-f]{2}[:\-]?[0-9A-Fa-f]{2}[:\-]?[0-9A-Fa-f]{2}[:\-]?[0-9A-Fa-f]{2})')
+
+# Function to build the MACs of synthetic_mac_file, in the order of its lines
+def synthetic_macs(count, seed=1):
+    rng = random.Random(seed)
+    return ["%012X" % rng.getrandbits(48) for _ in range(count)]
+
+# Function to build a noisy mac.txt body with one MAC per line in mixed formats, including inventory
+# labels touching bare MACs
+def synthetic_mac_file(count, seed=1):
+    lines = []
+    for i, mac in enumerate(synthetic_macs(count, seed)):
+        form = i % 8
+        if form == 0:
+            lines.append(mac)
+        elif form == 1:
+            lines.append(f"device {i}: " + ":".join(mac[j:j + 2] for j in range(0, 12, 2)).lower())
+        elif form == 2:
+            lines.append("-".join(mac[j:j + 2] for j in range(0, 12, 2)) + f" ; port {i % 48}")
+        elif form == 3:
+            lines.append(f"SN{i:08d},{mac},rack {i % 10}")
+        elif form == 4:
+            lines.append(f"MAC:{mac}")
+        elif form == 5:
+            lines.append(f"ID:{mac.lower()}")
+        elif form == 6:
+            lines.append(f"Device-{mac}")
+        else:
+            lines.append(f"{mac}-B{i % 4}")
+    return ("\n".join(lines) + "\n").encode()
+
+# Function to run the per-line regex and mac_processing path the way main() used to
+def legacy_scan(data):
+    found = []
+    for line in data.decode().splitlines():
+        found.extend(legacy_mac_pattern.findall(line.strip()))
+    valid_macs, invalid_macs = kgzcfg.mac_processing(found)
+    return valid_macs
+
+# Function to run the byte-level scanner over the same data
+def scanner_scan(data):
+    return [mac for mac, valid in kgzcfg.scan_macs(data) if valid]
+
+# Function to time a callable, returning the best of several runs
+def best_time(function, *args, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def bench_mac_scanning(count):
+    data = synthetic_mac_file(count)
+    legacy_time, legacy_macs = best_time(legacy_scan, data)
+    scanner_time, scanner_macs = best_time(scanner_scan, data)
+    print(f"MAC scanning, {count} lines, {len(data) / 1e6:.1f} MB")
+    print(f"  mac_pattern.findall + mac_processing : {legacy_time:.3f}s ({count / legacy_time:,.0f} lines/s)")
+    print(f"  scan_macs                            : {scanner_time:.3f}s ({count / scanner_time:,.0f} lines/s)")
+    expected = set(synthetic_macs(count))
+    print(f"  speedup x{legacy_time / scanner_time:.2f}, MACs found: legacy {len(expected & set(legacy_macs))}, "
+          f"scanner {len(expected & set(scanner_macs))} of {count}")
+
+# create_static_config as it was before the template compiler, kept here for comparison
+def legacy_create_static_config(mac, ip, account, model, dns_ip, subnet_mask, gateway_ip, ucm_ip):
+    return {
+        "device_start": [
+            "======== Device Start ========",
+            "mac,model,ip,file_url,version,vendor,url_parameter,config_name,account_secret,state,ad_state,port,hot_desking,last_access",
+            f"{mac},{model},{ip},https://{ucm_ip}:8089/zccgi/,1.0.5.58,Grandstream,,,,8,0,5060,no,2024-07-27 16:08:27",
+            "",
+        ],
+        "basic_settings": [
+            "######## Basic Settings ########",
+            "mac,element,element_number,entity_name,value",
+            f"{mac},Account,1,AccountChoice,{account}",
+            "",
+        ],
+        "advanced_settings": [
+            "******** Advanced Settings ********",
+            "mac,field_name,element_number,entity_name,value",
+            f"{mac},IPAddressMode,1,AddressMode,1",
+            f"{mac},IPAddressMode,1,DNSAddressType,0",
+        ] + [f"{mac},IPAddressMode,1,DNSServer1_{i + 1},{dns_ip.split('.')[i]}" for i in range(4)]
+          + [f"{mac},IPAddressMode,1,DNSServer2_{i + 1},{gateway_ip.split('.')[i]}" for i in range(4)]
+          + [f"{mac},IPAddressMode,1,Gateway_{i + 1},{gateway_ip.split('.')[i]}" for i in range(4)]
+          + [f"{mac},IPAddressMode,1,StaticIP_{i + 1},{ip.split('.')[i]}" for i in range(4)]
+          + [f"{mac},IPAddressMode,1,SubnetMask_{i + 1},{subnet_mask.split('.')[i]}" for i in range(4)]
+          + [""]
+    }
+
+# Function to build count (mac, ip, account) device tuples in a 10.0.0.0/8 network
+def synthetic_devices(count, seed=1):
+    rng = random.Random(seed)
+    ips = list(kgzcfg.generate_ip_range("10.0.0.10", count, "255.0.0.0", "10.0.0.1"))
+    return [("%012X" % rng.getrandbits(48), ips[i], 1000 + i) for i in range(count)]
+
+def legacy_render(devices):
+    return [legacy_create_static_config(mac, ip, account, "GRP2601P", "8.8.8.8", "255.0.0.0", "10.0.0.1", "10.0.0.2")
+            for mac, ip, account in devices]
+
+def template_render(devices):
+    render = kgzcfg.compile_static_template("GRP2601P", "10.0.0.2", "8.8.8.8", "255.0.0.0", "10.0.0.1")
+    return [render(mac, ip, account) for mac, ip, account in devices]
+
+def bench_static_rendering(count):
+    devices = synthetic_devices(count)
+    legacy_time, legacy_configs = best_time(legacy_render, devices)
+    template_time, template_configs = best_time(template_render, devices)
+    print(f"Static config rendering, {count} devices")
+    print(f"  create_static_config    : {legacy_time:.3f}s ({legacy_time / count * 1e6:.2f} us/device)")
+    print(f"  compile_static_template : {template_time:.3f}s ({template_time / count * 1e6:.2f} us/device)")
+    print(f"  speedup x{legacy_time / template_time:.2f}, same result: {legacy_configs == template_configs}")
+
+# append_config_to_csv as it was before the block writer, kept here for comparison
+def legacy_append_config_to_csv(export_zero_config_csv_file_path, configs):
+    with open(export_zero_config_csv_file_path, mode='a', newline='') as file:
+        writer = csv.writer(file)
+        for config in configs:
+            for section, rows in config.items():
+                for row in rows:
+                    writer.writerow(row.split(','))
+
+# Function to time a writer on a fresh file, returning the elapsed time and the written bytes
+def time_writer(writer, configs, directory):
+    path = os.path.join(directory, "export.csv")
+    if os.path.exists(path):
+        os.remove(path)
+    start = time.perf_counter()
+    writer(path, configs)
+    elapsed = time.perf_counter() - start
+    with open(path, 'rb') as file:
+        return elapsed, file.read()
+
+def bench_csv_writing(count):
+    configs = template_render(synthetic_devices(count))
+    with tempfile.TemporaryDirectory() as directory:
+        legacy_time, legacy_bytes = min(time_writer(legacy_append_config_to_csv, configs, directory) for _ in range(3))
+        block_time, block_bytes = min(time_writer(kgzcfg.append_config_to_csv, configs, directory) for _ in range(3))
+    size = len(block_bytes) / 1e6
+    print(f"Export CSV writing, {count} devices, {size:.1f} MB")
+    print(f"  csv.writer per row  : {legacy_time:.3f}s ({size / legacy_time:.1f} MB/s)")
+    print(f"  buffered block write: {block_time:.3f}s ({size / block_time:.1f} MB/s)")
+    print(f"  speedup x{legacy_time / block_time:.2f}, byte-identical: {legacy_bytes == block_bytes}")
+
+# Function to time append_shards_to_csv with a pool of workers, returning the elapsed time and the written bytes
+def time_shard_writer(devices, workers, directory):
+    from concurrent.futures import ProcessPoolExecutor
+    template = ("static", "GRP2601P", "10.0.0.2", "8.8.8.8", "255.0.0.0", "10.0.0.1")
+    with ProcessPoolExecutor(workers) as executor:
+        executor.submit(kgzcfg.render_shard, template, []).result()  # Start the workers before timing
+        return time_writer(lambda path, devices: kgzcfg.append_shards_to_csv(path, devices, template, executor, workers),
+                           devices, directory)
+
+def bench_parallel_rendering(count, workers=None):
+    workers = workers or os.cpu_count() or 1
+    devices = synthetic_devices(count)
+    render = kgzcfg.compile_static_template("GRP2601P", "10.0.0.2", "8.8.8.8", "255.0.0.0", "10.0.0.1")
+    with tempfile.TemporaryDirectory() as directory:
+        sequential_time, sequential_bytes = time_writer(lambda path, devices: kgzcfg.append_config_to_csv(path, kgzcfg.stream_configs(devices, render)),
+                                                        devices, directory)
+        print(f"Render and write, {count} devices, {os.cpu_count()} CPUs")
+        print(f"  sequential          : {sequential_time:.3f}s ({count / sequential_time:,.0f} devices/s)")
+        for pool_size in sorted({1, 2, workers}):
+            shard_time, shard_bytes = time_shard_writer(devices, pool_size, directory)
+            print(f"  {pool_size:2d} worker processes : {shard_time:.3f}s ({count / shard_time:,.0f} devices/s), "
+                  f"x{sequential_time / shard_time:.2f}, byte-identical: {shard_bytes == sequential_bytes}")
+
+# Function to write one XML file per device with a plain open() per file, the way a simple writer would
+def naive_write_xml(directory, devices, render):
+    for mac, ip, account in devices:
+        with open(os.path.join(directory, f"cfg{mac.lower()}.xml"), "wb") as file:
+            file.write(render(mac, account, ip))
+
+# Function to time writing the cfg<MAC>.xml files of count devices one by one and with XmlConfigWriter
+def bench_xml_writing(count):
+    devices = synthetic_devices(count)
+    render = kgzcfg.compile_xml_template("10.0.0.2", "8.8.8.8", "255.0.0.0", "10.0.0.1")
+    start = time.perf_counter()
+    collections.deque((render(mac, account, ip) for mac, ip, account in devices), maxlen=0)
+    render_time = time.perf_counter() - start
+    print(f"XML config files, {count} devices")
+    print(f"  render only          : {render_time:.3f}s ({count / render_time:,.0f} files/s)")
+    # The dirty pages of one run are flushed before the next so it doesn't pay for them
+    flush = getattr(os, "sync", lambda: None)
+    flush()
+    with tempfile.TemporaryDirectory() as directory:
+        start, start_times = time.perf_counter(), os.times()
+        naive_write_xml(directory, devices, render)
+        naive_time, times = time.perf_counter() - start, os.times()
+        print(f"  open() per file      : {naive_time:.3f}s ({count / naive_time:,.0f} files/s), "
+              f"{times.user - start_times.user:.3f}s user {times.system - start_times.system:.3f}s system")
+    for threads in sorted({1, kgzcfg.xml_writer_threads}):
+        flush()
+        with tempfile.TemporaryDirectory() as directory:
+            start, start_times = time.perf_counter(), os.times()
+            with kgzcfg.XmlConfigWriter(directory, render, threads) as writer:
+                for mac, ip, account in devices:
+                    writer.write(mac, account, ip)
+            writer_time, times = time.perf_counter() - start, os.times()
+            print(f"  {threads:2d} writer threads    : {writer_time:.3f}s ({count / writer_time:,.0f} files/s), "
+                  f"{times.user - start_times.user:.3f}s user {times.system - start_times.system:.3f}s system, "
+                  f"x{naive_time / writer_time:.2f}, with atomic renames")
+
+# Function to time a fresh interpreter running code, returning the best of several runs
+def time_interpreter(code, repeat=10):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", code], check=True)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def bench_import():
+    base_time = time_interpreter("pass")
+    import_time = time_interpreter("import kgzcfglib")
+    print("Library import, fresh interpreter")
+    print(f"  python -c pass            : {base_time * 1000:.1f}ms")
+    print(f"  python -c import kgzcfglib: {import_time * 1000:.1f}ms ({(import_time - base_time) * 1000:.1f}ms for the import)")
+
+# Function to build a noisy mac.txt body: the MACs of synthetic_mac_file mixed with repeated MACs,
+# invalid tokens, comments and blank lines
+def synthetic_noisy_mac_file(count, seed=1):
+    rng = random.Random(seed)
+    lines = synthetic_mac_file(count, seed).decode().splitlines()
+    for i in range(0, count, 50):
+        lines.insert(rng.randrange(len(lines)), rng.choice(lines))  # Repeated MAC
+        lines.insert(rng.randrange(len(lines)), rng.choice(["# spare phones", "", "FFFFFFFFFFFF", "00000000000G", "serial 0123456789ABCDEF",
+                                                            "MAC:00:0B:82:12:34:56"]))
+    return ("\n".join(lines) + "\n").encode()
+
+# Function to build an account.txt body holding count accounts as ranges of 100 with a few exclusions
+def synthetic_account_file(count, first=100000):
+    lines = []
+    last = first
+    while count > 0:
+        size = min(count, 100)
+        lines.append(f"{last}-{last + size}")
+        lines.append(f"!{last + size // 2}")
+        count -= size
+        last += 1000
+    return "\n".join(lines) + "\n"
+
+# Synthetic fleet sizes of the stage benchmarks
+fleet_sizes = (1000, 100000, 1000000)
+
+# Function to write the synthetic inputs of a fleet of count devices to directory, returning the
+# inputs every stage starts from, so preparing them is not part of any timing
+def synthetic_fleet(count, directory):
+    fleet = {"count": count, "directory": directory}
+    data = synthetic_noisy_mac_file(count)
+    fleet["mac_file"] = os.path.join(directory, "mac.txt")
+    with open(fleet["mac_file"], "wb") as file:
+        file.write(data)
+    fleet["account_file"] = os.path.join(directory, "account.txt")
+    with open(fleet["account_file"], "w") as file:
+        file.write(synthetic_account_file(count))
+    fleet["tokens"] = [match.group(0).decode() for match in kgzcfg.mac_scanner.finditer(data)]
+    fleet["all_macs"] = kgzcfg.load_mac_file(fleet["mac_file"])[0]
+    fleet["macs"] = fleet["all_macs"].unique()
+    fleet["ips"] = list(kgzcfg.generate_ip_range("10.0.0.10", len(fleet["macs"]), "255.0.0.0", "10.0.0.1"))
+    fleet["accounts"] = kgzcfg.load_account_pool(fleet["account_file"]).take(len(fleet["macs"]))
+    render = kgzcfg.compile_static_template("GRP2601P", "10.0.0.2", "8.8.8.8", "255.0.0.0", "10.0.0.1")
+    fleet["sample_configs"] = [render(*device) for device in zip(fleet["macs"][:1000], fleet["ips"], fleet["accounts"])]
+    return fleet
+
+def stage_scan(fleet):
+    kgzcfg.load_mac_file(fleet["mac_file"])
+
+def stage_validate(fleet):
+    kgzcfg.mac_processing(fleet["tokens"])
+
+def stage_unique(fleet):
+    fleet["all_macs"].unique()
+
+def stage_accounts(fleet):
+    kgzcfg.load_account_pool(fleet["account_file"]).take(len(fleet["macs"]))
+
+def stage_ip_allocation(fleet):
+    collections.deque(kgzcfg.generate_ip_range("10.0.0.10", len(fleet["macs"]), "255.0.0.0", "10.0.0.1"), maxlen=0)
+
+def stage_render_static(fleet):
+    render = kgzcfg.compile_static_template("GRP2601P", "10.0.0.2", "8.8.8.8", "255.0.0.0", "10.0.0.1")
+    collections.deque(itertools.starmap(render, zip(fleet["macs"], fleet["ips"], fleet["accounts"])), maxlen=0)
+
+def stage_render_dhcp(fleet):
+    render = kgzcfg.compile_dhcp_template("GRP2601P", "10.0.0.2")
+    collections.deque(itertools.starmap(render, zip(fleet["macs"], fleet["accounts"])), maxlen=0)
+
+# Writes already rendered configs, cycling through a sample so rendering is not part of the timing
+def stage_write(fleet):
+    path = os.path.join(fleet["directory"], "export.csv")
+    configs = itertools.islice(itertools.cycle(fleet["sample_configs"]), len(fleet["macs"]))
+    kgzcfg.append_config_to_csv(path, configs)
+    os.remove(path)
+
+# The whole run_site pipeline on a fresh site: MAC index, accounts, IPs, rendering and writing
+def stage_end_to_end(fleet):
+    base_directory = os.path.join(fleet["directory"], "run")
+    kgzcfg.run_site("bench", fleet["macs"], "GRP2601P", "10.0.0.2", 2, "10.0.0.10", "255.0.0.0", "10.0.0.1", "8.8.8.8",
+                    base_directory=base_directory, accounts=fleet["accounts"], log=kgzcfg.silent_log)
+    shutil.rmtree(base_directory)
+
+# Pipeline stages in the order a run goes through them
+stages = {
+    "scan": stage_scan,
+    "validate": stage_validate,
+    "unique": stage_unique,
+    "accounts": stage_accounts,
+    "ip_allocation": stage_ip_allocation,
+    "render_static": stage_render_static,
+    "render_dhcp": stage_render_dhcp,
+    "write": stage_write,
+    "end_to_end": stage_end_to_end,
+}
+
+# Function to run a stage under tracemalloc, returning its peak traced memory in bytes
+def stage_peak_memory(stage, fleet):
+    tracemalloc.start()
+    try:
+        stage(fleet)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+# Function to time and memory-profile every stage for each fleet size. Timings are the best of repeat
+# runs (one run for fleets of a million devices), memory is measured in a separate run as tracemalloc
+# slows the code it traces.
+def bench_stages(sizes=fleet_sizes, names=tuple(stages), repeat=3, memory=True):
+    results = {}
+    for count in sizes:
+        with tempfile.TemporaryDirectory() as directory:
+            fleet = synthetic_fleet(count, directory)
+            print(f"Stages, {count:,} devices ({len(fleet['macs']):,} unique valid MACs)")
+            results[str(count)] = {}
+            for name in names:
+                seconds, _ = best_time(stages[name], fleet, repeat=repeat if count < 1000000 else 1)
+                result = {"seconds": round(seconds, 6), "us_per_device": round(seconds / count * 1e6, 3)}
+                if memory:
+                    result["peak_bytes"] = stage_peak_memory(stages[name], fleet)
+                results[str(count)][name] = result
+                line = f"  {name:14s}: {seconds:8.3f}s {result['us_per_device']:8.2f} us/device"
+                if memory:
+                    line += f" {result['peak_bytes'] / 1e6:9.1f} MB peak"
+                print(line)
+    return results
+
+# Stages faster than this in both runs are too noisy to be reported as regressions
+min_compared_seconds = 0.01
+
+# Function to compare results with a baseline results file, returning the stages slower than the
+# baseline by more than threshold
+def compare_results(results, baseline, threshold):
+    regressions = []
+    print(f"Compared with the baseline of kgzcfg {baseline['version']} ({baseline['timestamp']})")
+    for size, size_results in results.items():
+        for name, result in size_results.items():
+            old = baseline["results"].get(size, {}).get(name)
+            if not old:
+                continue
+            ratio = result["seconds"] / old["seconds"] if old["seconds"] else 1
+            status = ""
+            if max(result["seconds"], old["seconds"]) < min_compared_seconds:
+                status = "too short to compare"
+            elif ratio > 1 + threshold:
+                status = "REGRESSION"
+            print(f"  {int(size):>9,} {name:14s}: {old['seconds']:8.3f}s -> {result['seconds']:8.3f}s x{ratio:.2f} {status}")
+            if status == "REGRESSION":
+                regressions.append((size, name, ratio))
+    return regressions
+
+# Function to run the comparisons with the code the library replaced
+def bench_legacy(count=100000):
+    bench_import()
+    bench_mac_scanning(count)
+    bench_static_rendering(count)
+    bench_csv_writing(count)
+    bench_parallel_rendering(count)
+    bench_xml_writing(count)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="kgzcfg benchmarks")
+    parser.add_argument("--sizes", default=",".join(map(str, fleet_sizes)), help="Comma separated fleet sizes")
+    parser.add_argument("--stages", default=",".join(stages), help="Comma separated stages to run")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per stage, the best one is kept")
+    parser.add_argument("--no-memory", action="store_true", help="Skip the tracemalloc runs")
+    parser.add_argument("--output", metavar="FILE", help="Write the results as JSON to FILE")
+    parser.add_argument("--compare", metavar="FILE", help="Compare with a results file written by --output")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Slowdown reported as a regression, 0.10 for 10%%")
+    parser.add_argument("--legacy", action="store_true", help="Run the comparisons with the replaced code instead")
+    args = parser.parse_args()
+    if args.legacy:
+        bench_legacy()
+        sys.exit(0)
+    names = [name for name in args.stages.split(",") if name]
+    unknown = [name for name in names if name not in stages]
+    if unknown:
+        parser.error(f"unknown stages: {', '.join(unknown)}")
+    results = bench_stages([int(size) for size in args.sizes.split(",")], names, args.repeat, not args.no_memory)
+    report = {
+        "version": kgzcfg.version,
+        "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+        print(f"Results written to '{args.output}'.")
+    if args.compare:
+        with open(args.compare) as file:
+            regressions = compare_results(results, json.load(file), args.threshold)
+        if regressions:
+            print(f"{len(regressions)} stages slower than the baseline by more than {args.threshold:.0%}.")
+            sys.exit(1)
@@ -0,0 +1,143 @@
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+# Function to pick a free TCP port on the loopback interface for a local server
+def free_port():
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+# Function to build the body of request number, a site of devices phones with MAC addresses and
+# accounts of their own so no request skips the devices of another
+def request_body(number, devices, mode):
+    first_account = 100000 + number * devices
+    body = {"model": "GRP2601P", "ucm_ip": "10.0.0.2", "ip_mode": mode,
+            "accounts": f"{first_account}-{first_account + devices - 1}",
+            "macs": ["%012X" % (0x00B0B0000000 + number * devices + i) for i in range(devices)]}
+    if mode == 2:
+        body.update(start_ip="10.0.0.10", subnet_mask="255.255.0.0")
+    return json.dumps(body).encode()
+
+# Function to read one HTTP response from reader, returning its status and body
+async def read_response(reader):
+    status = int((await reader.readline()).split()[1])
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    if headers.get("transfer-encoding") == "chunked":
+        chunks = []
+        while True:
+            size = int((await reader.readline()).strip(), 16)
+            chunk = await reader.readexactly(size + 2)
+            if not size:
+                break
+            chunks.append(chunk[:-2])
+        return status, b"".join(chunks)
+    return status, await reader.readexactly(int(headers.get("content-length", "0")))
+
+# Function to send requests over concurrency keep-alive connections, returning the latency of every
+# request, the number of failed requests and the devices provisioned
+async def run_load(host, port, requests, concurrency, devices, sites, mode):
+    numbers = iter(range(requests))
+    latencies = []
+    counts = {"failed": 0, "devices": 0}
+
+    async def client():
+        reader, writer = await asyncio.open_connection(host, port)
+        for number in numbers:
+            body = request_body(number, devices, mode)
+            writer.write((f"POST /sites/load{number % sites} HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\n"
+                          f"Content-Length: {len(body)}\r\n\r\n").encode() + body)
+            start = time.perf_counter()
+            await writer.drain()
+            status, data = await read_response(reader)
+            latencies.append(time.perf_counter() - start)
+            lines = data.splitlines()
+            if status != 200 or "result" not in json.loads(lines[-1]):
+                counts["failed"] += 1
+            else:
+                counts["devices"] += len(lines) - 1
+        writer.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return time.perf_counter() - start, latencies, counts
+
+# Function to get the value below which fraction of the sorted values fall
+def percentile(values, fraction):
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+# Function to wait until the HTTP API answers GET /health
+def wait_for_server(host, port, timeout=10):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        try:
+            with socket.create_connection((host, port), timeout=1) as connection:
+                connection.sendall(b"GET /health HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n")
+                if connection.recv(64).startswith(b"HTTP/1.1 200"):
+                    return
+        except OSError:
+            time.sleep(0.1)
+    raise SystemExit(f"The HTTP API on {host}:{port} did not start.")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="kgzcfg HTTP API load test")
+    parser.add_argument("--server", metavar="HOST:PORT", help="Load a running HTTP API instead of starting one in a temporary folder")
+    parser.add_argument("--requests", type=int, default=2000, help="Number of requests")
+    parser.add_argument("--concurrency", type=int, default=32, help="Requests in flight at a time")
+    parser.add_argument("--devices", type=int, default=10, help="Devices per request")
+    parser.add_argument("--sites", type=int, default=8, help="Sites the requests are spread over")
+    parser.add_argument("--mode", type=int, choices=(1, 2), default=2, help="IP Phones mode, 1 for DHCP or 2 for Static")
+    parser.add_argument("--output", metavar="FILE", help="Write the results as JSON to FILE")
+    args = parser.parse_args()
+
+    server = None
+    if args.server:
+        host, _, port = args.server.rpartition(":")
+        host, port = host or "127.0.0.1", int(port)
+    else:
+        host, port = "127.0.0.1", free_port()
+        directory = tempfile.mkdtemp(prefix="kgzcfg-load-")
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "kgzcfg.py")
+        server = subprocess.Popen([sys.executable, script, "--http", f"{host}:{port}"], cwd=directory,
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for_server(host, port)
+        seconds, latencies, counts = asyncio.run(run_load(host, port, args.requests, args.concurrency, args.devices, args.sites, args.mode))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+            shutil.rmtree(directory)
+
+    latencies.sort()
+    results = {
+        "requests": len(latencies),
+        "failed": counts["failed"],
+        "devices": counts["devices"],
+        "concurrency": args.concurrency,
+        "seconds": round(seconds, 3),
+        "requests_per_second": round(len(latencies) / seconds, 1),
+        "devices_per_second": round(counts["devices"] / seconds, 1),
+        "latency_ms": {name: round(percentile(latencies, fraction) * 1000, 2)
+                       for name, fraction in (("p50", 0.50), ("p90", 0.90), ("p99", 0.99), ("max", 1.0))},
+    }
+    print(f"{results['requests']} requests ({results['failed']} failed) of {args.devices} devices over {args.concurrency} connections "
+          f"in {results['seconds']}s")
+    print(f"{results['requests_per_second']} requests/s, {results['devices_per_second']} devices/s")
+    print("Latency: " + ", ".join(f"{name} {value} ms" for name, value in results["latency_ms"].items()))
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
@@ -0,0 +1,2749 @@
+import csv
+import sys
+import re
+import ipaddress
+import os
+import shutil
+import time
+import bisect
+import io
+import json
+import itertools
+import collections
+import contextlib
+import threading
+import mmap
+from array import array
+
+version = "1.0.7.2" # Version of the library and the kgzcfg script
+
+# sqlite3 and hashlib load native libraries and make up about a third of the import time, so they are
+# only imported by the functions that use them
+
+# Function to check if input is numeric
+def is_numeric(input_str):
+    return re.match(r"^\d{2,}$", input_str) is not None
+
+# Function to validate if the input is a valid IP address
+def is_valid_ip(ip):
+    ip_pattern = re.compile(r"^(25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)\."
+                            r"(25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)\."
+                            r"(25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)\."
+                            r"(25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)$") # Regular expression for IPv4
+    return bool(ip_pattern.match(ip))  # Return True if valid, False otherwise
+
+# Function to validate subnet mask input
+def is_valid_subnet_mask(subnet_mask):
+    try:
+        subnet = ipaddress.IPv4Network(f"0.0.0.0/{subnet_mask}", strict=False)  # Parse subnet mask
+        return not subnet.with_prefixlen.endswith('/0')  # Ensure the subnet is valid
+    except ValueError:
+        return False
+
+# Byte-level scanner for MAC addresses in bare, colon or dash form. The separator must be the same
+# across the whole MAC and the match must not touch other hex characters, so 12 characters in the
+# middle of a longer serial number are not picked up. Labels such as "MAC:" or "-B2" may touch a bare
+# MAC; a separated MAC touching its own separator and more hex is checked by scan_macs.
+mac_scanner = re.compile(rb'(?<![0-9A-Fa-f])'
+                         rb'[0-9A-Fa-f]{2}([:\-]?)[0-9A-Fa-f]{2}(?:\1[0-9A-Fa-f]{2}){4}'
+                         rb'(?![0-9A-Fa-f])')
+mac_token_bytes = b"0123456789ABCDEFabcdef:-"
+mac_hex_bytes = b"0123456789ABCDEFabcdef"
+
+# Function to find the span of the run of hex characters and sep around data[first:last] within data[start:end]
+def separated_run(data, first, last, sep, start, end):
+    while first > start and (data[first - 1:first] == sep or data[first - 1:first] in mac_hex_bytes):
+        first -= 1
+    while last < end and (data[last:last + 1] == sep or data[last:last + 1] in mac_hex_bytes):
+        last += 1
+    return first, last
+
+# Function to scan raw bytes in a single pass, yielding (mac, is_valid) pairs
+def scan_macs(data, start=0, end=None):
+    if end is None:
+        end = len(data)
+    run_end = start  # end of the last run reported as ambiguous
+    for match in mac_scanner.finditer(data, start, end):
+        if match.start() < run_end:
+            continue
+        token = match.group(0)
+        sep = match.group(1)
+        # "AC:00:0B:82:12:34:56" holds more groups than a MAC, which six of them is meant is unclear
+        if sep and (data.endswith(sep, start, match.start()) or data.startswith(sep, match.end(), end)):
+            first, last = match.span()
+            if (first - 2 >= start and data[first - 1:first] == sep and data[first - 2:first - 1] in mac_hex_bytes
+                    or last + 2 <= end and data[last:last + 1] == sep and data[last + 1:last + 2] in mac_hex_bytes):
+                first, run_end = separated_run(data, first, last, sep, start, end)
+                yield data[first:run_end].strip(sep).decode(), False
+                continue
+        mac = token.upper() if len(token) == 12 else token.translate(None, b":-").upper()
+        # Reject all same-character addresses like '111111111111'
+        if mac.count(mac[:1]) == 12:
+            yield token.decode(), False
+        else:
+            yield mac.decode(), True
+
+# Function to check if a MAC address is valid
+def is_valid_mac(mac):
+    # Remove any separators (colons or dashes)
+    cleaned_mac = mac.replace(":", "").replace("-", "").upper()
+    # Check if the MAC address has exactly 12 hexadecimal characters and isn't a repeating sequence
+    if len(cleaned_mac) == 12 and re.match(r'^[0-9A-F]{12}$', cleaned_mac):
+        if len(set(cleaned_mac)) > 1:  # Rejects all same-character addresses like '111111111111'
+            return True
+    return False
+
+# Size of the blocks read from mac.txt at a time
+mac_file_chunk_size = 1 << 20
+
+# Function to lazily yield (mac, is_valid) pairs found in a file, reading it in large raw chunks.
+# on_read is called with the size of every chunk read.
+def iter_mac_file(mac_file_path, chunk_size=mac_file_chunk_size, on_read=None):
+    with open(mac_file_path, 'rb') as file:
+        tail = b""
+        while True:
+            chunk = file.read(chunk_size)
+            if not chunk:
+                break
+            if on_read is not None:
+                on_read(len(chunk))
+            chunk = tail + chunk
+            # Keep a trailing partial token for the next chunk so no MAC is split in two
+            cut = len(chunk.rstrip(mac_token_bytes))
+            tail = chunk[cut:]
+            yield from scan_macs(chunk, 0, cut)
+        if tail:
+            yield from scan_macs(tail)
+
+# Function to read the MAC addresses of a file into a MacTable, returning it with the invalid ones
+def load_mac_file(mac_file_path):
+    mac_addresses = MacTable()
+    invalid_macs = []
+    for mac, valid in iter_mac_file(mac_file_path):
+        if valid:
+            mac_addresses.append(mac)
+        else:
+            invalid_macs.append(mac)
+    return mac_addresses, invalid_macs
+
+# Function to lazily normalize found MAC addresses, yielding (mac, is_valid) pairs
+def iter_mac_processing(found_macs):
+    for mac in found_macs:
+        formatted_mac = mac.replace(":", "").replace("-", "").upper()
+        if is_valid_mac(formatted_mac):
+            yield formatted_mac, True
+        else:
+            yield mac, False
+
+# Function to process the MAC addresses found in the file or input
+def mac_processing(found_macs):
+    valid_macs = []
+    invalid_macs = []
+
+    for mac, valid in iter_mac_processing(found_macs):
+        if valid:
+            valid_macs.append(mac)
+        else:
+            invalid_macs.append(mac)
+
+    return valid_macs, invalid_macs
+
+# Function to pack a 12 character MAC address into a 48-bit integer
+def mac_to_int(mac):
+    return int(mac, 16)
+
+# Function to format a packed MAC address back into the C074AD73443A form
+def int_to_mac(value):
+    return "%012X" % value
+
+# Compact MAC address table, every MAC is stored as a 48-bit integer in an array('Q')
+class MacTable:
+    def __init__(self, macs=()):
+        self.values = array('Q')
+        self.extend(macs)
+
+    def append(self, mac):
+        self.values.append(mac_to_int(mac))
+
+    def extend(self, macs):
+        self.values.extend(map(mac_to_int, macs))
+
+    def __len__(self):
+        return len(self.values)
+
+    # MACs are only formatted back to strings when they are read
+    def __iter__(self):
+        return map(int_to_mac, self.values)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            table = MacTable()
+            table.values = self.values[index]
+            return table
+        return int_to_mac(self.values[index])
+
+    def __contains__(self, mac):
+        return mac_to_int(mac) in self.values
+
+    def as_set(self):
+        return set(self.values)
+
+    def sort(self):
+        self.values = array('Q', sorted(self.values))
+
+    # Function to drop repeated MAC addresses, keeping the first occurrence
+    def unique(self):
+        seen = set()
+        table = MacTable()
+        table.values = array('Q', [value for value in self.values if not (value in seen or seen.add(value))])
+        return table
+
+# Check if a given value exists in a list
+def is_in_list(input_value, my_list):
+    return input_value in my_list
+
+# List of supported phone models
+supported_model_list = ["GHP610", "GHP610W", "GHP611", "GHP611W", "GHP620", "GHP620W", "GHP621", "GHP621W", "GHP630", "GHP630W", "GHP631", "GHP631W", "GRP2601", "GRP2601P", "GRP2601W", "GRP2602", "GRP2602G", "GRP2602P", "GRP2602W", "GRP2603", "GRP2603P", "GRP2604", "GRP2604P", "GRP2612", "GRP2612G", "GRP2612P", "GRP2612W", "GRP2613", "GRP2614", "GRP2615", "GRP2616", "GRP2624", "GRP2634", "GRP2636", "GRP2650", "GRP2670", "GSC3505", "GSC3506", "GSC3510", "GSC3516", "GSC3570", "GSC3574", "GSC3575", "GSC3610", "GSC3615", "GSC3620", "GXP1100", "GXP1105", "GXP1600C", "GXP1610C", "GXP1610P", "GXP1615", "GXP1628B", "GXP1760", "GXP1760W", "GXP1780", "GXP1782", "GXP2130", "GXP2135", "GXP2136", "GXP2140", "GXP2160", "GXP2170", "GXV3240", "GXV3275", "GXV3350", "GXV3370", "GXV3380", "GXV3450", "GXV3470", "GXV3480", "GXV3500", "WP800", "WP810", "WP816", "WP820", "WP822", "WP825", "WP826", "WP856",]
+
+# Function to get the file paths of a site without creating anything, the kgzcfg folder is looked
+# up in base_directory or the current directory
+def get_site_paths(project, base_directory=None):
+    kgzcfg = "kgzcfg"
+    script_directory = base_directory or os.getcwd()  # Get the current script directory
+    folder_path = os.path.join(script_directory, kgzcfg, project)  # Set folder path based on project name
+
+    # Set file paths for output files
+    export_zero_config_csv_file_name = "kgzcfg_export_zc_devices.csv"
+    mac_file_name = "mac.txt"
+    deployment_file_name = "deployment-details.csv"
+    deployment_jsonl_file_name = "deployment-details.jsonl"
+    journal_file_name = "kgzcfg-journal.json"
+    account_file_name = "account.txt"
+    mac_index_file_name = "mac_index.db"
+    reserved_file_name = "reserved-ranges.txt"
+    xml_directory_name = "xml"
+
+    export_zero_config_csv_file_path = os.path.join(folder_path, export_zero_config_csv_file_name)  # Full path for config file
+    mac_file_path = os.path.join(script_directory, kgzcfg, mac_file_name)  # Path for MAC address file
+    deployment_file_path = os.path.join(folder_path, deployment_file_name)  # Path for deployment file
+    deployment_jsonl_file_path = os.path.join(folder_path, deployment_jsonl_file_name)  # Path for deployment JSON Lines file
+    journal_file_path = os.path.join(folder_path, journal_file_name)  # Path for the --atomic run journal
+    account_file_path = os.path.join(script_directory, kgzcfg, account_file_name)  # Path for MAC address file
+    mac_index_path = os.path.join(script_directory, kgzcfg, mac_index_file_name)  # Path for the MAC index shared by all sites
+    reserved_file_path = os.path.join(folder_path, reserved_file_name)  # Path for the site's reserved IP ranges
+    xml_directory_path = os.path.join(folder_path, xml_directory_name)  # Path for the site's per-device XML config files
+    return (export_zero_config_csv_file_path, mac_file_path, deployment_file_path, account_file_path, mac_index_path, reserved_file_path, deployment_jsonl_file_path, journal_file_path, xml_directory_path)
+
+# Function to get the configuration file paths, creating the site folder and its files
+def get_config_file(project, base_directory=None, log=print):
+    paths = get_site_paths(project, base_directory)
+    export_zero_config_csv_file_path, deployment_file_path = paths[0], paths[2]
+    folder_path = os.path.dirname(export_zero_config_csv_file_path)
+
+    # Create the directory if it doesn't exist
+    if not os.path.exists(folder_path):
+        os.makedirs(folder_path)
+        log(f"Folder '{folder_path}' created successfully.")
+    else:
+        log(f"Folder '{folder_path}' already exists.")
+
+    # Create the files if they don't exist
+    for file_path in (export_zero_config_csv_file_path, deployment_file_path):
+        file_name = os.path.basename(file_path)
+        if os.path.exists(file_path):
+            log(f"Found existing '{file_name}' in the '{project}' folder as the script.")
+        else:
+            with open(file_path, "a"):
+                log(f"Created '{file_name}' in the '{project}' folder as the script.")
+    return paths
+
+# Seconds to wait for another process writing the MAC index, as sites run in parallel share it
+mac_index_timeout = 60
+
+# Function to open the persistent MAC index shared by all sites, creating it if needed. A read only
+# index is never created, an empty one is used in memory instead.
+def open_mac_index(mac_index_path, read_only=False):
+    import sqlite3
+    if read_only:
+        if os.path.exists(mac_index_path):
+            return sqlite3.connect(f"file:{mac_index_path}?mode=ro", uri=True, timeout=mac_index_timeout)
+        mac_index_path = ":memory:"
+    connection = sqlite3.connect(mac_index_path, timeout=mac_index_timeout)
+    connection.execute("CREATE TABLE IF NOT EXISTS devices ("
+                       "mac INTEGER PRIMARY KEY, site TEXT NOT NULL, account TEXT, ip TEXT, provisioned_at TEXT NOT NULL)")
+    return connection
+
+# Function to look up which of the given MAC addresses are already provisioned, keyed by packed MAC
+def lookup_provisioned_macs(connection, macs, batch_size=500):
+    provisioned = {}
+    macs = list(set(map(mac_to_int, macs)))
+    for i in range(0, len(macs), batch_size):
+        batch = macs[i:i + batch_size]
+        rows = connection.execute("SELECT mac, site, account, ip, provisioned_at FROM devices "
+                                  f"WHERE mac IN ({','.join('?' * len(batch))})", batch)
+        for mac, site, account, ip, provisioned_at in rows:
+            provisioned[mac] = (site, account, ip, provisioned_at)
+    return provisioned
+
+# Number of provisioned devices recorded in the MAC index at a time
+mac_index_batch_size = 10000
+
+# Function to record provisioned devices in the MAC index, records are (mac, account, ip) tuples
+def record_provisioned_macs(connection, site, records):
+    provisioned_at = time.strftime("%Y-%m-%d %H:%M:%S")
+    with connection:
+        connection.executemany("INSERT OR REPLACE INTO devices (mac, site, account, ip, provisioned_at) VALUES (?, ?, ?, ?, ?)",
+                               ((mac_to_int(mac), site, str(account), ip, provisioned_at) for mac, account, ip in records))
+
+# Policies deciding when the deployment records are forced to disk
+fsync_policies = ("none", "batch", "always")
+
+# Deployment record sink holding one handle on deployment-details.csv for the whole run. Records are
+# buffered and flushed every batch_size records, and the fsync policy decides when they are forced to
+# disk: "none" leaves it to the OS, "batch" fsyncs every flushed batch and "always" every record.
+# When jsonl_file_path is given, every record is also written there as one JSON object per line.
+class DeploymentSink:
+    def __init__(self, deployment_file_path, jsonl_file_path=None, site="", batch_size=1000, fsync_policy="none"):
+        if fsync_policy not in fsync_policies:
+            raise ValueError(f"Invalid fsync policy: {fsync_policy}")
+        self.site = site
+        self.batch_size = 1 if fsync_policy == "always" else batch_size
+        self.fsync_policy = fsync_policy
+        self.files = [open(deployment_file_path, mode='a')]
+        if jsonl_file_path:
+            self.files.append(open(jsonl_file_path, mode='a'))
+        self.pending = [[] for _ in self.files]
+        self.count = 0
+
+    # Function to add one device record, ip is None for DHCP devices
+    def write(self, mac, account, ip=None):
+        if ip is None:
+            self.pending[0].append(f"MAC Address,{mac},Account,{account}\n")
+        else:
+            self.pending[0].append(f"MAC Address,{mac},IP,{ip},Account,{account}\n")
+        if len(self.files) > 1:
+            record = {"site": self.site, "mac": mac, "ip": ip, "account": str(account), "mode": "dhcp" if ip is None else "static"}
+            self.pending[1].append(json.dumps(record) + "\n")
+        self.count += 1
+        if self.count >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        for file, lines in zip(self.files, self.pending):
+            if lines:
+                file.writelines(lines)
+                lines.clear()
+            file.flush()
+            if self.fsync_policy != "none":
+                os.fsync(file.fileno())
+        self.count = 0
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            for file in self.files:
+                file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+# Function to write a JSON file atomically, the data is on disk before it replaces the old file
+def write_json_atomic(file_path, data):
+    temp_path = file_path + ".tmp"
+    with open(temp_path, 'w') as file:
+        json.dump(data, file)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_path, file_path)
+
+# Function to read a journal file, returning None if there is none or it is unreadable
+def read_journal(journal_file_path):
+    try:
+        with open(journal_file_path, 'r') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+# Function to finish a commit that was interrupted, returning True if there was one. The targets are
+# cut back to the sizes they had before the commit started and the parts are appended again, so
+# running it twice gives the same result. on_commit is called with the part paths before they are
+# removed.
+def finish_output_commit(journal_file_path, on_commit=None):
+    journal = read_journal(journal_file_path)
+    if not journal or journal.get("state") != "committing":
+        return False
+    part_paths = [target_path + ".part" for target_path in journal["targets"]]
+    for target_path, part_path, size in zip(journal["targets"], part_paths, journal["sizes"]):
+        with open(target_path, 'ab') as target:
+            target.truncate(size)
+            with open(part_path, 'rb') as part:
+                shutil.copyfileobj(part, target, write_buffer_size)
+            target.flush()
+            os.fsync(target.fileno())
+    if on_commit is not None:
+        on_commit(part_paths)
+    os.remove(journal_file_path)
+    for part_path in part_paths:
+        os.remove(part_path)
+    return True
+
+# Transactional output used by --atomic runs. Rows go to "<target>.part" files next to the targets,
+# and every checkpoint saves the part sizes and the number of devices in them to a journal. A new
+# run with the same inputs cuts the parts back to the last checkpoint and resumes after those
+# devices. commit() records the target sizes in the journal before appending the parts, so an
+# interrupted commit is redone by finish_output_commit().
+class OutputTransaction:
+    def __init__(self, journal_file_path, target_paths, fingerprint):
+        self.journal_file_path = journal_file_path
+        self.target_paths = list(target_paths)
+        self.part_paths = [target_path + ".part" for target_path in self.target_paths]
+        self.fingerprint = fingerprint
+        self.devices = 0
+
+    def save_journal(self, state, sizes):
+        write_json_atomic(self.journal_file_path, {"state": state, "fingerprint": self.fingerprint, "devices": self.devices,
+                                                   "targets": self.target_paths, "sizes": sizes})
+
+    # Function to start writing, returning the number of devices an interrupted run already wrote
+    def begin(self):
+        journal = read_journal(self.journal_file_path)
+        if (journal and journal.get("state") == "writing" and journal.get("fingerprint") == self.fingerprint
+                and journal.get("targets") == self.target_paths and all(map(os.path.exists, self.part_paths))):
+            for part_path, size in zip(self.part_paths, journal["sizes"]):
+                with open(part_path, 'ab') as part:
+                    part.truncate(size)
+            self.devices = journal["devices"]
+            return self.devices
+        for part_path in self.part_paths:
+            open(part_path, 'wb').close()
+        self.devices = 0
+        self.save_journal("writing", [0] * len(self.part_paths))
+        return 0
+
+    # Function to record that devices more devices are completely written and synced to the parts
+    def checkpoint(self, devices):
+        self.devices += devices
+        self.save_journal("writing", [os.path.getsize(part_path) for part_path in self.part_paths])
+
+    # Function to append the parts to the targets and drop the journal
+    def commit(self, on_commit=None):
+        self.save_journal("committing", [os.path.getsize(path) if os.path.exists(path) else 0 for path in self.target_paths])
+        finish_output_commit(self.journal_file_path, on_commit)
+
+# Function to format a number of seconds as h:mm:ss or m:ss
+def format_seconds(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes}:{seconds:02d}"
+
+# Progress of the stage being worked on, with its rate and ETA. The hot loops only add to a counter
+# through advance, a background thread redraws the line every interval seconds. Nothing is drawn
+# when the stream is not a terminal. Messages printed while the line is shown must go through log,
+# which clears the line first.
+class ProgressReporter:
+    def __init__(self, stream=None, interval=0.2):
+        self.stream = stream or sys.stdout
+        self.interval = interval
+        self.enabled = hasattr(self.stream, "isatty") and self.stream.isatty()
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.thread = None
+        self.drawn = False
+        self.stage = ""
+        self.total = None
+        self.unit = ""
+        self.done = 0
+        self.started = time.perf_counter()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    # Function to start a stage of total units, total is None when it isn't known up front
+    def start(self, stage, total=None, unit="devices"):
+        with self.lock:
+            self.stage = stage
+            self.total = total
+            self.unit = unit
+            self.done = 0
+            self.started = time.perf_counter()
+        if self.enabled and self.thread is None:
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+
+    def advance(self, count=1):
+        self.done += count
+
+    def run(self):
+        while not self.stopping.wait(self.interval):
+            if self.stage:
+                self.draw()
+
+    # Function to format the progress line, |####----| 42.00% Writing: 4,200/10,000 devices - 50,000 devices/s - ETA 0:01
+    def format(self):
+        elapsed = max(time.perf_counter() - self.started, 1e-9)
+        rate = self.done / elapsed
+        if self.total:
+            percent = 100 * min(self.done / self.total, 1)
+            bar_width = int(20 * percent / 100)
+            line = f"|{'#' * bar_width}{'-' * (20 - bar_width)}| {percent:.2f}% {self.stage}: {self.done:,}/{self.total:,} {self.unit}"
+        else:
+            line = f"{self.stage}: {self.done:,} {self.unit}"
+        line += f" - {rate:,.0f} {self.unit}/s"
+        if self.total and rate > 0 and self.done < self.total:
+            line += f" - ETA {format_seconds((self.total - self.done) / rate)}"
+        return line[:shutil.get_terminal_size().columns - 1]
+
+    def draw(self):
+        with self.lock:
+            self.stream.write("\r" + self.format() + "\x1b[K")
+            self.stream.flush()
+            self.drawn = True
+
+    # Function to end the current stage, leaving its final progress line on the screen
+    def finish(self):
+        if self.enabled and self.stage:
+            self.draw()
+            with self.lock:
+                self.stream.write("\n")
+                self.drawn = False
+        self.stage = ""
+
+    def close(self):
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        with self.lock:
+            if self.drawn:
+                self.stream.write("\r\x1b[K")
+                self.drawn = False
+
+    # Function to print a message above the progress line, called like print
+    def log(self, *args, **kwargs):
+        with self.lock:
+            if self.drawn:
+                self.stream.write("\r\x1b[K")
+                self.drawn = False
+            print(*args, file=self.stream, **kwargs)
+
+# Named stage timers for a run. begin() ends the stage before it, so the pipeline only marks where
+# each stage starts. wrap() times a function called many times inside a stage, such as rendering
+# one device; its time is taken out of the enclosing stage. With cprofile every stage gets its own
+# cProfile.Profile, with memory tracemalloc records each stage's peak and its top allocations.
+class StageProfiler:
+    def __init__(self, enabled=True, cprofile=False, memory=False, top_allocations=10):
+        self.enabled = enabled
+        self.cprofile = cprofile
+        self.memory = memory
+        self.top_allocations = top_allocations
+        self.stages = {}
+        self.profiles = {}
+        self.current = None
+        self.nested = 0.0
+        self.started = 0.0
+        if enabled and memory:
+            import tracemalloc
+            self.tracemalloc = tracemalloc
+            tracemalloc.start()
+
+    def stats(self, name):
+        return self.stages.setdefault(name, {"seconds": 0.0, "calls": 0})
+
+    def begin(self, name):
+        if not self.enabled:
+            return
+        self.end()
+        self.current = name
+        self.nested = 0.0
+        if self.memory:
+            self.tracemalloc.reset_peak()
+            self.snapshot = self.tracemalloc.take_snapshot()
+            self.memory_start = self.tracemalloc.get_traced_memory()[0]
+        if self.cprofile:
+            import cProfile
+            self.profiles.setdefault(name, cProfile.Profile()).enable()
+        self.started = time.perf_counter()
+
+    def end(self):
+        if self.current is None:
+            return
+        elapsed = time.perf_counter() - self.started
+        name = self.current
+        self.current = None
+        if self.cprofile:
+            self.profiles[name].disable()
+        stats = self.stats(name)
+        stats["seconds"] += elapsed - self.nested
+        stats["calls"] += 1
+        if self.memory:
+            peak = self.tracemalloc.get_traced_memory()[1] - self.memory_start
+            stats["peak_bytes"] = max(stats.get("peak_bytes", 0), peak)
+            top = self.tracemalloc.take_snapshot().compare_to(self.snapshot, "lineno")[:self.top_allocations]
+            stats["top_allocations"] = [{"where": f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+                                         "size_diff": stat.size_diff, "count_diff": stat.count_diff} for stat in top]
+
+    def wrap(self, name, function):
+        if not self.enabled:
+            return function
+        stats = self.stats(name)
+
+        def timed(*args):
+            start = time.perf_counter()
+            try:
+                return function(*args)
+            finally:
+                elapsed = time.perf_counter() - start
+                stats["seconds"] += elapsed
+                stats["calls"] += 1
+                self.nested += elapsed
+        return timed
+
+    # Function to end the current stage and write the stats as JSON to stats_file_path, with the
+    # cProfile dumps of the stages next to it as kgzcfg-profile-<stage>.prof
+    def write(self, stats_file_path, **details):
+        self.end()
+        directory = os.path.dirname(stats_file_path)
+        os.makedirs(directory, exist_ok=True)
+        profile_files = []
+        for name, profile in self.profiles.items():
+            profile_files.append(os.path.join(directory, f"kgzcfg-profile-{name}.prof"))
+            profile.dump_stats(profile_files[-1])
+        stages = {name: {key: round(value, 6) if isinstance(value, float) else value for key, value in stats.items()}
+                  for name, stats in self.stages.items()}
+        report = {"version": version, "profiled_at": time.strftime("%Y-%m-%d %H:%M:%S"), **details,
+                  "seconds": round(sum(stats["seconds"] for stats in self.stages.values()), 6),
+                  "stages": stages, "cprofile_files": profile_files}
+        with open(stats_file_path, "w") as file:
+            json.dump(report, file, indent=2)
+        if self.memory:
+            self.tracemalloc.stop()
+        return report
+
+# Function to format an integer IPv4 address in dotted form
+def int_to_ip(value):
+    return "%d.%d.%d.%d" % (value >> 24, (value >> 16) & 255, (value >> 8) & 255, value & 255)
+
+# Largest subnet handled by SubnetAllocator, one byte of state is kept per address
+max_allocator_addresses = 1 << 24
+
+# Free-address map of one subnet, one byte per address with 1 meaning taken. The network, broadcast
+# and gateway addresses are taken from the start, free addresses are found with bytearray.find,
+# which scans in C, so gaps are found quickly even in a /16 holding thousands of phones.
+class SubnetAllocator:
+    def __init__(self, start_ip, subnet_mask="255.255.255.0", gateway_ip=""):
+        self.network = ipaddress.IPv4Network(f"{start_ip}/{subnet_mask}", strict=False)
+        if self.network.num_addresses > max_allocator_addresses:
+            raise ValueError(f"Subnet {self.network} is too large, use a /8 or smaller subnet.")
+        self.base = int(self.network.network_address)
+        self.used = bytearray(self.network.num_addresses)
+        if self.network.prefixlen < 31:
+            self.used[0] = self.used[-1] = 1
+        if gateway_ip:
+            self.reserve(gateway_ip)
+
+    # Function to mark an address as taken, addresses outside the subnet are ignored
+    def reserve(self, ip):
+        self.reserve_range(ip, ip)
+
+    # Function to mark an inclusive range of addresses as taken, clipped to the subnet
+    def reserve_range(self, first_ip, last_ip):
+        first = max(int(ipaddress.IPv4Address(first_ip)) - self.base, 0)
+        last = min(int(ipaddress.IPv4Address(last_ip)) - self.base, len(self.used) - 1)
+        if first <= last:
+            self.used[first:last + 1] = b"\x01" * (last - first + 1)
+
+    # Function to count the free addresses from start_ip to the end of the subnet
+    def free_count(self, start_ip):
+        return self.used.count(0, max(int(ipaddress.IPv4Address(start_ip)) - self.base, 0))
+
+    # Function to hand out count free addresses from start_ip onwards. The capacity is checked before
+    # anything is handed out and a ValueError is raised if the subnet cannot hold count hosts.
+    def allocate(self, start_ip, count):
+        if ipaddress.IPv4Address(start_ip) not in self.network:
+            raise ValueError(f"Starting IP {start_ip} is not in subnet {self.network}.")
+        available = self.free_count(start_ip)
+        if available < count:
+            raise ValueError(f"Subnet {self.network} can only hold {available} more IP Phones from {start_ip}, {count} needed.")
+        return self.iter_allocate(int(ipaddress.IPv4Address(start_ip)) - self.base, count)
+
+    # Function to get an allocator with the same addresses taken that is changed on its own
+    def copy(self):
+        allocator = SubnetAllocator.__new__(SubnetAllocator)
+        allocator.network = self.network
+        allocator.base = self.base
+        allocator.used = bytearray(self.used)
+        return allocator
+
+    def iter_allocate(self, offset, count):
+        used = self.used
+        for _ in range(count):
+            offset = used.find(0, offset)
+            used[offset] = 1
+            yield int_to_ip(self.base + offset)
+            offset += 1
+
+# Function to hand out count host addresses from start_ip onwards within its subnet, skipping the
+# network, broadcast and gateway addresses and anything already taken in allocator
+def generate_ip_range(start_ip, count, subnet_mask="255.255.255.0", gateway_ip="", allocator=None):
+    if allocator is None:
+        allocator = SubnetAllocator(start_ip, subnet_mask, gateway_ip)
+    return allocator.allocate(start_ip, count)
+
+# Function to parse one line of a deployment-details.csv into its (mac, account, ip) record, ip is None
+# for DHCP devices and None is returned for lines that are not records
+def parse_deployment_record(line):
+    fields = line.rstrip("\n").split(",")
+    if len(fields) == 6 and fields[0] == "MAC Address" and fields[2] == "IP" and fields[4] == "Account":
+        return fields[1], fields[5], fields[3]
+    elif len(fields) == 4 and fields[0] == "MAC Address" and fields[2] == "Account":
+        return fields[1], fields[3], None
+    return None
+
+# Function to read the (mac, account, ip) records of a deployment-details.csv, ip is None for DHCP devices
+def iter_deployment_records(deployment_file_path):
+    try:
+        with open(deployment_file_path, 'r') as file:
+            for line in file:
+                record = parse_deployment_record(line)
+                if record is not None:
+                    yield record
+    except FileNotFoundError:
+        return
+
+# Function to read the IP addresses already assigned in a site's deployment-details.csv
+def load_deployment_ips(deployment_file_path):
+    for mac, account, ip in iter_deployment_records(deployment_file_path):
+        if ip is not None and is_valid_ip(ip):
+            yield ip
+
+# Function to read a reserved ranges file, yielding (first_ip, last_ip) pairs. Every line holds a
+# single address, a "first-last" range or a CIDR network, anything after '#' is a comment. Invalid
+# lines are skipped with a message through log.
+def load_reserved_ranges(reserved_file_path, log=print):
+    try:
+        with open(reserved_file_path, 'r') as file:
+            for number, line in enumerate(file, 1):
+                entry = line.split("#", 1)[0].strip()
+                if not entry:
+                    continue
+                try:
+                    if "/" in entry:
+                        network = ipaddress.IPv4Network(entry, strict=False)
+                        yield str(network.network_address), str(network.broadcast_address)
+                    elif "-" in entry:
+                        first_ip, last_ip = (ipaddress.IPv4Address(ip.strip()) for ip in entry.split("-", 1))
+                        yield str(first_ip), str(last_ip)
+                    else:
+                        yield str(ipaddress.IPv4Address(entry)), entry
+                except ValueError:
+                    log(f"Ignoring invalid reserved range on line {number} of '{reserved_file_path}': {entry}")
+    except FileNotFoundError:
+        return
+
+# Bytes before the read offset of a DeploymentIndex compared on refresh to notice a rewritten file
+deployment_index_check_bytes = 64
+
+# Deployment records of one site kept in memory by a long running process. refresh() only reads what
+# was appended to deployment-details.csv since the last call, and starts over when the file was
+# replaced, cut back or rewritten. The allocators seeded with the deployment IP addresses are kept
+# per subnet and gateway and follow the new records, so a small job in a large site doesn't read and
+# reserve every address again.
+class DeploymentIndex:
+    def __init__(self, deployment_file_path):
+        self.deployment_file_path = deployment_file_path
+        self.reset()
+
+    def reset(self):
+        self.records = []
+        self.offset = 0
+        self.inode = None
+        self.tail = b""
+        self.allocators = {}
+
+    # Function to read the records appended since the last refresh
+    def refresh(self):
+        try:
+            file = open(self.deployment_file_path, 'rb')
+        except FileNotFoundError:
+            self.reset()
+            return self
+        with file:
+            stat = os.fstat(file.fileno())
+            check_offset = max(self.offset - deployment_index_check_bytes, 0)
+            file.seek(check_offset)
+            if stat.st_ino != self.inode or stat.st_size < self.offset or file.read(self.offset - check_offset) != self.tail:
+                self.reset()
+                self.inode = stat.st_ino
+                file.seek(0)
+            data = file.read()
+        # A line still being written is left for the next refresh
+        data = data[:data.rfind(b"\n") + 1]
+        if not data:
+            return self
+        new_records = [record for record in map(parse_deployment_record, data.decode().split("\n")) if record is not None]
+        self.records += new_records
+        self.tail = (self.tail + data)[-deployment_index_check_bytes:]
+        self.offset += len(data)
+        for allocator in self.allocators.values():
+            for mac, account, ip in new_records:
+                if ip is not None and is_valid_ip(ip):
+                    allocator.reserve(ip)
+        return self
+
+    # Function to get a new allocator for the subnet of start_ip with the deployment IP addresses taken,
+    # copied from the one kept for the subnet and gateway
+    def allocator(self, start_ip, subnet_mask="255.255.255.0", gateway_ip=""):
+        allocator = SubnetAllocator(start_ip, subnet_mask, gateway_ip)
+        key = (allocator.network, gateway_ip)
+        if key not in self.allocators:
+            for mac, account, ip in self.records:
+                if ip is not None and is_valid_ip(ip):
+                    allocator.reserve(ip)
+            self.allocators[key] = allocator
+        return self.allocators[key].copy()
+
+# State kept warm by a long running process between the jobs it runs: the paths of the sites already
+# set up and their deployment indexes. Compiled templates are kept in compiled_templates.
+class SiteCache:
+    def __init__(self):
+        self.site_paths = {}
+        self.deployment_indexes = {}
+
+    # Function to get the configuration file paths of a site, setting the site up like
+    # get_config_file the first time or when its export file is gone
+    def config_paths(self, project, base_directory=None, log=print):
+        key = (project, base_directory)
+        paths = self.site_paths.get(key)
+        if paths is None or not os.path.exists(paths[0]):
+            paths = self.site_paths[key] = get_config_file(project, base_directory, log)
+        return paths
+
+    # Function to get the refreshed deployment index of a deployment-details.csv
+    def deployment_index(self, deployment_file_path):
+        if deployment_file_path not in self.deployment_indexes:
+            self.deployment_indexes[deployment_file_path] = DeploymentIndex(deployment_file_path)
+        return self.deployment_indexes[deployment_file_path].refresh()
+
+# Regular expression for one account range token: "1000", "1000-1999", "!1500" or "!1500-1510"
+account_range_pattern = re.compile(r"^(!?)(\d{2,})(?:-(\d{2,}))?$")
+
+# Function to remove the parts of [first, last] already in covered, a sorted list of disjoint intervals
+def subtract_intervals(first, last, covered):
+    pieces = []
+    index = max(bisect.bisect_right(covered, (first,)) - 1, 0)
+    while first <= last and index < len(covered):
+        covered_first, covered_last = covered[index]
+        if covered_first > last:
+            break
+        if covered_last >= first:
+            if covered_first > first:
+                pieces.append((first, covered_first - 1))
+            first = covered_last + 1
+        index += 1
+    if first <= last:
+        pieces.append((first, last))
+    return pieces
+
+# Function to add [first, last] to covered, a sorted list of disjoint intervals, merging neighbours
+def insert_interval(first, last, covered):
+    index = bisect.bisect_left(covered, (first,))
+    if index > 0 and covered[index - 1][1] + 1 >= first:
+        index -= 1
+        first = covered[index][0]
+        last = max(last, covered[index][1])
+    end = index
+    while end < len(covered) and covered[end][0] <= last + 1:
+        last = max(last, covered[end][1])
+        end += 1
+    covered[index:end] = [(first, last)]
+
+# Function to format an account number zero-padded to width, accounts without a width stay numbers
+def format_account(account, width=0):
+    return str(account).zfill(width) if width else account
+
+# Pool of account numbers stored as intervals. Accounts are handed out in the order they were added,
+# accounts added twice are only kept once and excluded accounts are never handed out. An interval
+# given with a width, such as 0101-0110, hands out its accounts zero-padded to that width.
+class AccountPool:
+    def __init__(self, intervals=(), excluded=()):
+        self.intervals = []  # (first, last, width) in allocation order, consecutive runs merged
+        self.covered = []    # sorted intervals already in the pool or excluded
+        self.offsets = [0]   # number of accounts before each interval, for indexing
+        for first, last in excluded:
+            insert_interval(first, last, self.covered)
+        for first, last, *width in intervals:
+            self.add(first, last, *width)
+
+    @classmethod
+    def from_expression(cls, expression):
+        intervals, excluded = parse_account_ranges(expression)
+        return cls(intervals, excluded)
+
+    # Function to add the accounts first..last that are not already covered, zero-padded to width
+    def add(self, first, last, width=0):
+        for piece_first, piece_last in subtract_intervals(first, last, self.covered):
+            if self.intervals and self.intervals[-1][1] + 1 == piece_first and self.intervals[-1][2] == width:
+                self.intervals[-1] = (self.intervals[-1][0], piece_last, width)
+                self.offsets[-1] += piece_last - piece_first + 1
+            else:
+                self.intervals.append((piece_first, piece_last, width))
+                self.offsets.append(self.offsets[-1] + piece_last - piece_first + 1)
+            insert_interval(piece_first, piece_last, self.covered)
+
+    def __len__(self):
+        return self.offsets[-1]
+
+    def __iter__(self):
+        for first, last, width in self.intervals:
+            if width:
+                yield from (format_account(account, width) for account in range(first, last + 1))
+            else:
+                yield from range(first, last + 1)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("account pool index out of range")
+        interval = bisect.bisect_right(self.offsets, index) - 1
+        first, last, width = self.intervals[interval]
+        return format_account(first + index - self.offsets[interval], width)
+
+    # Function to return a pool holding only the first count accounts
+    def take(self, count):
+        pool = AccountPool()
+        for first, last, width in self.intervals:
+            if count <= 0:
+                break
+            last = min(last, first + count - 1)
+            pool.add(first, last, width)
+            count -= last - first + 1
+        return pool
+
+    def __str__(self):
+        ranges = []
+        for first, last, width in self.intervals:
+            first_account, last_account = format_account(first, width), format_account(last, width)
+            ranges.append(str(first_account) if first == last else f"{first_account}-{last_account}")
+        return ",".join(ranges)
+
+# Function to parse range expressions like "1000-1999,2100-2150,!1500" into (intervals, excluded).
+# Intervals are (first, last, width) with width the length of a zero-padded first account, else 0.
+def parse_account_ranges(expression):
+    intervals = []
+    excluded = []
+    for token in re.split(r"[,\s]+", expression.strip()):
+        if not token:
+            continue
+        match = account_range_pattern.match(token)
+        if not match:
+            raise ValueError(f"Invalid account range: {token}")
+        first = int(match.group(2))
+        last = int(match.group(3) or first)
+        if last < first:
+            raise ValueError(f"Invalid account range: {token}")
+        if match.group(1):
+            excluded.append((first, last))
+        else:
+            intervals.append((first, last, len(match.group(2)) if match.group(2).startswith("0") else 0))
+    return intervals, excluded
+
+# Function to read account.txt into an AccountPool. Every line holds one account or a list of ranges,
+# invalid lines are skipped with a message through log.
+def load_account_pool(account_file_path, log=print):
+    intervals = []
+    excluded = []
+    with open(account_file_path, 'r') as file:
+        for number, line in enumerate(file, 1):
+            try:
+                line_intervals, line_excluded = parse_account_ranges(line)
+            except ValueError as error:
+                log(f"Ignoring line {number} of account.txt. {error}")
+                continue
+            intervals.extend(line_intervals)
+            excluded.extend(line_excluded)
+    return AccountPool(intervals, excluded)
+
+def generate_account_numbers(start_account, count, width=0):
+    return AccountPool([(start_account, start_account + count - 1, width)])
+
+# Section titles and column headers of the zero config export, shared by every device
+device_start_title = "======== Device Start ========"
+device_start_header = "mac,model,ip,file_url,version,vendor,url_parameter,config_name,account_secret,state,ad_state,port,hot_desking,last_access"
+basic_settings_title = "######## Basic Settings ########"
+basic_settings_header = "mac,element,element_number,entity_name,value"
+advanced_settings_title = "******** Advanced Settings ********"
+advanced_settings_header = "mac,field_name,element_number,entity_name,value"
+
+# Function to build the URL phones fetch their config from, the UCM's zero config URL unless file_url is given
+def device_file_url(ucm_ip, file_url=""):
+    return file_url or f"https://{ucm_ip}:8089/zccgi/"
+
+# Function to build the constant tail of the device row that follows the IP column
+def device_row_suffix(ucm_ip, file_url=""):
+    return f",{device_file_url(ucm_ip, file_url)},1.0.5.58,Grandstream,,,,8,0,5060,no,2024-07-27 16:08:27"
+
+# Function to precompute everything that is constant in a batch of DHCP configs, returning a
+# function that renders one device from its mac and account
+def compile_dhcp_template(model, ucm_ip, file_url=""):
+    model_column = f",{model},0.0.0.0"
+    ip_suffix = device_row_suffix(ucm_ip, file_url)
+    account_prefix = ",Account,1,AccountChoice,"
+
+    def render(mac, account):
+        return {
+            "device_start": [device_start_title, device_start_header, mac + model_column + ip_suffix, ""],
+            "basic_settings": [basic_settings_title, basic_settings_header, f"{mac}{account_prefix}{account}", ""],
+        }
+    return render
+
+# Function to precompute everything that is constant in a batch of static IP configs, including the
+# split DNS, gateway and subnet mask octets, returning a function that renders one device from its
+# mac, ip and account
+def compile_static_template(model, ucm_ip, dns_ip, subnet_mask, gateway_ip, file_url=""):
+    model_column = f",{model},"
+    ip_suffix = device_row_suffix(ucm_ip, file_url)
+    account_prefix = ",Account,1,AccountChoice,"
+    dns = dns_ip.split('.')
+    gateway = gateway_ip.split('.')
+    mask = subnet_mask.split('.')
+    fixed_rows = [",IPAddressMode,1,AddressMode,1", ",IPAddressMode,1,DNSAddressType,0"]
+    fixed_rows += [f",IPAddressMode,1,DNSServer1_{i + 1},{dns[i]}" for i in range(4)]
+    fixed_rows += [f",IPAddressMode,1,DNSServer2_{i + 1},{gateway[i]}" for i in range(4)]
+    fixed_rows += [f",IPAddressMode,1,Gateway_{i + 1},{gateway[i]}" for i in range(4)]
+    static_ip_prefixes = [f",IPAddressMode,1,StaticIP_{i + 1}," for i in range(4)]
+    mask_rows = [f",IPAddressMode,1,SubnetMask_{i + 1},{mask[i]}" for i in range(4)]
+
+    def render(mac, ip, account):
+        octets = ip.split('.')
+        advanced_settings = [advanced_settings_title, advanced_settings_header]
+        advanced_settings += [mac + row for row in fixed_rows]
+        advanced_settings += [mac + static_ip_prefixes[i] + octets[i] for i in range(4)]
+        advanced_settings += [mac + row for row in mask_rows]
+        advanced_settings.append("")
+        return {
+            "device_start": [device_start_title, device_start_header, mac + model_column + ip + ip_suffix, ""],
+            "basic_settings": [basic_settings_title, basic_settings_header, f"{mac}{account_prefix}{account}", ""],
+            "advanced_settings": advanced_settings,
+        }
+    return render
+
+def create_dhcp_config(mac, account, model, ucm_ip, file_url=""):
+    return compile_dhcp_template(model, ucm_ip, file_url)(mac, account)
+
+def create_static_config(mac, ip, account, model, dns_ip, subnet_mask, gateway_ip, ucm_ip, file_url=""):
+    return compile_static_template(model, ucm_ip, dns_ip, subnet_mask, gateway_ip, file_url)(mac, ip, account)
+
+# Function to lazily render device configs for the writer. on_device is called with the same
+# arguments right after the device's config is rendered.
+def stream_configs(devices, render, on_device=None):
+    for device in devices:
+        config = render(*device)
+        if on_device is not None:
+            on_device(*device)
+        yield config
+
+# Function to render a device config into its CSV block. The result is byte-identical to writing the
+# rows with csv.writer: lines end with CRLF and a blank row is written as "". Rows holding a character
+# that makes csv.writer quote a field are rendered through csv.writer. The characters are looked up
+# with str.__contains__, a regex character class is about 50 times slower on a 1.4 KB block.
+def config_to_block(config):
+    rows = [row for section_rows in config.values() for row in section_rows]
+    text = "".join(rows)
+    if '"' in text or "\r" in text or "\n" in text:
+        buffer = io.StringIO(newline='')
+        writer = csv.writer(buffer)
+        for row in rows:
+            writer.writerow(row.split(','))
+        return buffer.getvalue()
+    return "\r\n".join([row or '""' for row in rows]) + "\r\n"
+
+# Buffer size of the export file and number of device blocks written with one call
+write_buffer_size = 1 << 20
+write_chunk_devices = 1000
+
+# Function to append device configs to the export file, joining the blocks of write_chunk_devices
+# devices and writing them with one call through a large buffer. configs may also hold blocks already
+# made by config_to_block. on_chunk is called with the open file and the number of devices after
+# every written chunk.
+def append_config_to_csv(export_zero_config_csv_file_path, configs, on_chunk=None):
+    with open(export_zero_config_csv_file_path, mode='ab', buffering=write_buffer_size) as file:
+        chunk = []
+        for config in configs:
+            chunk.append(config if isinstance(config, str) else config_to_block(config))
+            if len(chunk) >= write_chunk_devices:
+                file.write("".join(chunk).encode())
+                if on_chunk is not None:
+                    on_chunk(file, len(chunk))
+                chunk.clear()
+        if chunk:
+            file.write("".join(chunk).encode())
+            if on_chunk is not None:
+                on_chunk(file, len(chunk))
+
+# Number of devices rendered by one worker process task, and the smallest site split into such shards
+shard_devices = 2000
+min_shard_site_devices = 10 * shard_devices
+
+# Templates compiled in this process, keyed by their inputs
+compiled_templates = {}
+
+# Function to compile a device template once per process from its inputs, ("dhcp", model, ucm_ip,
+# file_url) or ("static", model, ucm_ip, dns_ip, subnet_mask, gateway_ip, file_url), file_url may be
+# left out. Worker processes get these tuples as the compiled render functions can't be sent to them.
+def compile_template(template):
+    if template not in compiled_templates:
+        if template[0] == "dhcp":
+            compiled_templates[template] = compile_dhcp_template(*template[1:])
+        else:
+            compiled_templates[template] = compile_static_template(*template[1:])
+    return compiled_templates[template]
+
+# Function run in a worker process to render a shard of devices into the bytes of their CSV blocks
+def render_shard(template, devices):
+    render = compile_template(template)
+    return "".join([config_to_block(render(*device)) for device in devices]).encode()
+
+# Function to append devices to the export file with their blocks rendered by the worker processes of
+# executor, shard_devices at a time. Shards are written in order, so the file is byte-identical to
+# append_config_to_csv. Once a shard is written on_device is called for each of its devices, then
+# on_chunk with the open file and the number of devices.
+def append_shards_to_csv(export_zero_config_csv_file_path, devices, template, executor, workers, on_device=None, on_chunk=None):
+    devices = iter(devices)
+    pending = collections.deque()
+    with open(export_zero_config_csv_file_path, mode='ab', buffering=write_buffer_size) as file:
+        while True:
+            # Keep two shards per worker in flight so the workers don't wait for the writer
+            while len(pending) < 2 * workers:
+                shard = list(itertools.islice(devices, shard_devices))
+                if not shard:
+                    break
+                pending.append((shard, executor.submit(render_shard, template, shard)))
+            if not pending:
+                break
+            shard, future = pending.popleft()
+            file.write(future.result())
+            if on_device is not None:
+                for device in shard:
+                    on_device(*device)
+            if on_chunk is not None:
+                on_chunk(file, len(shard))
+
+# Grandstream P-values of the per-device XML config files: the IP address type (0 for DHCP, 1 for
+# static), the octets of the static IP address, subnet mask, gateway and DNS servers, and the SIP
+# user ID, authenticate ID, SIP server, account name and account active of the first account
+xml_ip_type = "P8"
+xml_ip_octets = ("P9", "P10", "P11", "P12")
+xml_mask_octets = ("P13", "P14", "P15", "P16")
+xml_gateway_octets = ("P17", "P18", "P19", "P20")
+xml_dns1_octets = ("P21", "P22", "P23", "P24")
+xml_dns2_octets = ("P25", "P26", "P27", "P28")
+xml_sip_user_id = "P35"
+xml_auth_id = "P36"
+xml_sip_server = "P47"
+xml_account_name = "P270"
+xml_account_active = "P271"
+
+# Function to render the XML rows of the octets of an IPv4 address
+def xml_octet_rows(names, ip):
+    return "".join(f"    <{name}>{octet}</{name}>\n" for name, octet in zip(names, ip.split(".")))
+
+# Function to precompute everything that is constant in a batch of cfg<MAC>.xml files, returning a
+# function that renders the bytes of one device's file from its mac, account and ip, None for DHCP.
+# The settings are the ones create_static_config writes, the second DNS server is the gateway too.
+def compile_xml_template(ucm_ip, dns_ip="", subnet_mask="", gateway_ip=""):
+    from xml.sax.saxutils import escape
+    head = '<?xml version="1.0" encoding="UTF-8" ?>\n<gs_provision version="1">\n  <mac>'
+    config_start = '</mac>\n  <config version="1">\n'
+    dhcp_rows = f"    <{xml_ip_type}>0</{xml_ip_type}>\n"
+    static_rows = ""
+    if gateway_ip:
+        static_rows = (xml_octet_rows(xml_mask_octets, subnet_mask) + xml_octet_rows(xml_gateway_octets, gateway_ip)
+                       + xml_octet_rows(xml_dns1_octets, dns_ip) + xml_octet_rows(xml_dns2_octets, gateway_ip))
+    tail = (f"    <{xml_sip_server}>{ucm_ip}</{xml_sip_server}>\n    <{xml_account_active}>1</{xml_account_active}>\n"
+            "  </config>\n</gs_provision>\n")
+
+    def render(mac, account, ip=None):
+        account = escape(str(account))
+        if ip is None:
+            ip_rows = dhcp_rows
+        else:
+            ip_rows = f"    <{xml_ip_type}>1</{xml_ip_type}>\n" + xml_octet_rows(xml_ip_octets, ip) + static_rows
+        return (head + mac.lower() + config_start + ip_rows
+                + f"    <{xml_sip_user_id}>{account}</{xml_sip_user_id}>\n    <{xml_auth_id}>{account}</{xml_auth_id}>\n"
+                + f"    <{xml_account_name}>{account}</{xml_account_name}>\n" + tail).encode()
+    return render
+
+# Number of XML files written by one writer thread task, and the number of writer threads
+xml_batch_files = 256
+xml_writer_threads = min(8, (os.cpu_count() or 1) + 4)
+
+# Function run in a writer thread to write a batch of (file name, data) pairs to a directory, given
+# as an open directory_fd where the platform allows it so the path isn't looked up for every file.
+# Every file is written under a temporary name and renamed over the old one, so a phone never fetches
+# a half-written file. With fsync the files, then the directory, are forced to disk.
+def write_xml_batch(directory_path, directory_fd, files, fsync=False):
+    for name, data in files:
+        temp_name = f".{name}.tmp"
+        if directory_fd is None:
+            temp_name, name = os.path.join(directory_path, temp_name), os.path.join(directory_path, name)
+        fd = os.open(temp_name, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0), 0o644, dir_fd=directory_fd)
+        try:
+            view = memoryview(data)
+            while view:
+                view = view[os.write(fd, view):]
+            if fsync:
+                os.fsync(fd)
+        finally:
+            os.close(fd)
+        os.replace(temp_name, name, src_dir_fd=directory_fd, dst_dir_fd=directory_fd)
+    if fsync and directory_fd is not None:
+        os.fsync(directory_fd)
+
+# Writer of the per-device cfg<MAC>.xml files of a site. Files are rendered here as devices are
+# added and written by a pool of threads xml_batch_files at a time, the threads spend their time in
+# system calls that release the GIL. At most two batches per thread are in flight, and the first
+# error of a writer thread is raised by write() or close().
+class XmlConfigWriter:
+    def __init__(self, directory_path, render, threads=xml_writer_threads, fsync=False):
+        from concurrent.futures import ThreadPoolExecutor
+        os.makedirs(directory_path, exist_ok=True)
+        self.directory_path = directory_path
+        self.directory_fd = None
+        if os.open in os.supports_dir_fd and os.replace in os.supports_dir_fd:
+            self.directory_fd = os.open(directory_path, os.O_RDONLY)
+        self.render = render
+        self.threads = threads
+        self.fsync = fsync
+        self.executor = ThreadPoolExecutor(threads)
+        self.pending = collections.deque()
+        self.batch = []
+        self.count = 0
+
+    # Function to add the file of one device, ip is None for DHCP devices
+    def write(self, mac, account, ip=None):
+        self.batch.append((f"cfg{mac.lower()}.xml", self.render(mac, account, ip)))
+        self.count += 1
+        if len(self.batch) >= xml_batch_files:
+            self.submit()
+
+    def submit(self):
+        if self.batch:
+            self.pending.append(self.executor.submit(write_xml_batch, self.directory_path, self.directory_fd, self.batch, self.fsync))
+            self.batch = []
+        while len(self.pending) > 2 * self.threads:
+            self.pending.popleft().result()
+
+    # Function to write the remaining files and wait for the writer threads
+    def close(self):
+        try:
+            self.submit()
+            while self.pending:
+                self.pending.popleft().result()
+        finally:
+            self.executor.shutdown()
+            if self.directory_fd is not None:
+                os.close(self.directory_fd)
+                self.directory_fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+# Section title lines of the export file mapped to the section keys used by create_*_config
+export_section_titles = {
+    device_start_title.encode(): "device_start",
+    basic_settings_title.encode(): "basic_settings",
+    advanced_settings_title.encode(): "advanced_settings",
+}
+export_device_start = device_start_title.encode()
+export_block_end = b'""\r\n'
+
+# Function to digest one device block of the export file
+def block_digest(block):
+    import hashlib
+    return hashlib.blake2b(block, digest_size=16).hexdigest()
+
+# Function to stream the device blocks of an export file opened in binary mode, starting at byte
+# offset. A state machine walks the lines: a Device Start title opens a new block, the row after its
+# header names the MAC, and the block runs until the next Device Start title or the end of the file.
+# Yields (mac, offset, block) for every block.
+def iter_export_blocks(file, offset=0):
+    file.seek(offset)
+    mac = None
+    block_offset = offset
+    lines = []
+    state = None  # None outside a block, else (section, rows seen in the section)
+    for line in file:
+        title = line.rstrip(b"\r\n")
+        if title == export_device_start:
+            if mac is not None:
+                yield mac, block_offset, b"".join(lines)
+            mac = ""
+            block_offset = offset
+            lines = []
+            state = ("device_start", 0)
+        elif state is not None:
+            section, rows = state
+            if title in export_section_titles:
+                state = (export_section_titles[title], 0)
+            else:
+                if section == "device_start" and rows == 1 and not mac:
+                    mac = title.split(b",", 1)[0].decode().upper()
+                state = (section, rows + 1)
+        if state is not None:
+            lines.append(line)
+        offset += len(line)
+    if mac is not None:
+        yield mac, block_offset, b"".join(lines)
+
+# Function to parse one device block back into the dict of section rows made by create_*_config
+def parse_export_block(block):
+    config = {}
+    rows = None
+    for line in block.decode().split("\r\n")[:-1]:
+        section = export_section_titles.get(line.encode())
+        if section is not None:
+            rows = config.setdefault(section, [])
+        elif rows is None:
+            continue
+        rows.append("" if line == '""' else line)
+    return config
+
+# Sidecar index of an export file, stored next to it as "<export>.idx". It maps every MAC to the
+# byte offset, length and digest of its latest device block, so one device can be read with a single
+# seek. The index remembers how many bytes it covers, the digest of the last block and the inode and
+# modification time of the file; if the file only grew since, just the new bytes are parsed. A file
+# that was replaced, as rewrite_export_file does, or changed without growing gets the index rebuilt.
+class ExportIndex:
+    def __init__(self, export_zero_config_csv_file_path):
+        self.export_path = export_zero_config_csv_file_path
+        self.index_path = export_zero_config_csv_file_path + ".idx"
+        self.clear()
+
+    def clear(self):
+        self.blocks = {}      # mac -> [offset, length, digest]
+        self.size = 0         # bytes of the export file covered by the index
+        self.last_block = None
+        self.duplicates = 0   # blocks superseded by a later block of the same MAC
+        self.identity = None  # [inode, mtime in ns] of the export file when it was indexed
+
+    # Function to load the sidecar index and bring it up to date with the export file, saving it
+    # back unless save is False
+    def load(self, save=True):
+        try:
+            with open(self.index_path, 'r') as file:
+                data = json.load(file)
+            self.blocks, self.size = data["blocks"], data["size"]
+            self.last_block, self.duplicates = data["last_block"], data["duplicates"]
+            self.identity = data.get("identity")
+        except (OSError, ValueError, KeyError):
+            self.clear()
+        if self.update() and save:
+            self.save()
+        return self
+
+    # Function to index the bytes appended since the last update, returning True if anything changed.
+    # Only complete blocks are indexed: a last block not ending with its blank row is still being
+    # written and is left for the next update, and the last indexed block is parsed again in case it
+    # was cut right after one of its sections.
+    def update(self):
+        try:
+            stat = os.stat(self.export_path)
+            size, identity = stat.st_size, [stat.st_ino, stat.st_mtime_ns]
+        except FileNotFoundError:
+            size, identity = 0, None
+        if size == self.size and identity == self.identity:
+            return False
+        if (identity is None or self.identity is None or identity[0] != self.identity[0] or size <= self.size
+                or not self.is_current()):
+            self.clear()
+        self.identity = identity
+        if identity is None:
+            return True
+        covered = size
+        with open(self.export_path, 'rb', buffering=write_buffer_size) as file:
+            for mac, offset, block in iter_export_blocks(file, self.last_block[0] if self.last_block else 0):
+                if offset + len(block) == size and not block.endswith(export_block_end):
+                    covered = offset
+                    break
+                if mac in self.blocks and self.blocks[mac][0] != offset:
+                    self.duplicates += 1
+                self.blocks[mac] = self.last_block = [offset, len(block), block_digest(block)]
+        self.size = covered
+        return True
+
+    # Function to check that the last indexed block is still in place in the export file
+    def is_current(self):
+        if self.last_block is None:
+            return self.size == 0
+        offset, length, digest = self.last_block
+        try:
+            with open(self.export_path, 'rb') as file:
+                file.seek(offset)
+                return block_digest(file.read(length)) == digest
+        except FileNotFoundError:
+            return False
+
+    def save(self):
+        write_json_atomic(self.index_path, {"size": self.size, "last_block": self.last_block, "duplicates": self.duplicates,
+                                            "identity": self.identity, "blocks": self.blocks})
+
+    def __contains__(self, mac):
+        return mac in self.blocks
+
+    def __len__(self):
+        return len(self.blocks)
+
+    # Function to read the raw block of one MAC, or None if the MAC is not in the export file
+    def read_block(self, mac):
+        entry = self.blocks.get(mac)
+        if entry is None:
+            return None
+        with open(self.export_path, 'rb') as file:
+            file.seek(entry[0])
+            return file.read(entry[1])
+
+    # Function to read the raw blocks of many MACs through one memory map, yielding (mac, block)
+    def read_blocks(self, macs):
+        if not self.size:
+            return
+        with open(self.export_path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as view:
+            for mac in macs:
+                entry = self.blocks.get(mac)
+                if entry is not None:
+                    yield mac, view[entry[0]:entry[0] + entry[1]]
+
+    # Function to parse the current config of one MAC, or None if it is not in the export file
+    def get_config(self, mac):
+        block = self.read_block(mac)
+        return None if block is None else parse_export_block(block)
+
+# Function to copy the bytes start..end of a memory map to a file in write_buffer_size pieces
+def copy_range(view, start, end, file):
+    for position in range(start, end, write_buffer_size):
+        file.write(view[position:min(position + write_buffer_size, end)])
+
+# Function to rewrite an export file in one streaming pass, replacing the blocks of the MACs in
+# changed (mac -> new block), dropping blocks superseded by a later block of the same MAC and
+# appending the blocks stored in new_blocks_path. The result replaces the export file atomically
+# and the index is moved to the new offsets.
+def rewrite_export_file(index, changed, new_blocks_path):
+    temp_path = index.export_path + ".tmp"
+    with open(index.export_path, 'rb') as source, open(temp_path, 'wb', buffering=write_buffer_size) as target:
+        if index.duplicates:
+            # Superseded blocks are only known by a full pass, which also yields the new offsets
+            blocks = {}
+            for mac, offset, block in iter_export_blocks(source):
+                if index.blocks[mac][0] != offset:
+                    continue
+                block = changed.get(mac, block)
+                blocks[mac] = [target.tell(), len(block), block_digest(block)]
+                target.write(block)
+            index.blocks = blocks
+        elif index.size:
+            # Copy the unchanged byte ranges around the changed blocks, then shift the offsets
+            with mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ) as view:
+                position = 0
+                shift_offsets = []
+                shifts = [0]
+                for mac in sorted(changed, key=lambda mac: index.blocks[mac][0]):
+                    offset, length, digest = index.blocks[mac]
+                    copy_range(view, position, offset, target)
+                    target.write(changed[mac])
+                    position = offset + length
+                    shift_offsets.append(offset)
+                    shifts.append(shifts[-1] + len(changed[mac]) - length)
+                copy_range(view, position, index.size, target)
+            for mac, entry in index.blocks.items():
+                shift = shifts[bisect.bisect_left(shift_offsets, entry[0])]
+                if mac in changed:
+                    entry[1:] = [len(changed[mac]), block_digest(changed[mac])]
+                entry[0] += shift
+        index.size = target.tell()
+        index.last_block = max(index.blocks.values(), default=None)
+        index.duplicates = 0
+        with open(new_blocks_path, 'rb') as new_blocks:
+            shutil.copyfileobj(new_blocks, target, write_buffer_size)
+        target.flush()
+        os.fsync(target.fileno())
+        # The offsets are already moved, so the index stays valid for the file replacing the export file
+        stat = os.fstat(target.fileno())
+        index.identity = [stat.st_ino, stat.st_mtime_ns]
+    os.replace(temp_path, index.export_path)
+
+# Function to upsert device configs into an export file. Each device is rendered and compared with
+# the digest of its block in the export index: new devices are appended, changed devices are
+# rewritten in place and unchanged devices are left alone. When nothing changed, the new blocks are
+# only appended. on_device is called with the status ("new", "changed" or "unchanged") followed
+# by the device arguments, right after on_block is called with the device's block. Returns the
+# number of devices per status.
+def upsert_config_to_csv(export_zero_config_csv_file_path, devices, render, on_device=None, on_block=None):
+    index = ExportIndex(export_zero_config_csv_file_path).load()
+    counts = {"new": 0, "changed": 0, "unchanged": 0}
+    changed = {}
+    new_blocks_path = export_zero_config_csv_file_path + ".new"
+    with open(new_blocks_path, 'wb', buffering=write_buffer_size) as new_blocks:
+        for device in devices:
+            block = config_to_block(render(*device)).encode()
+            entry = index.blocks.get(device[0])
+            if entry is None:
+                new_blocks.write(block)
+                status = "new"
+            elif entry[2] != block_digest(block):
+                changed[device[0]] = block
+                status = "changed"
+            else:
+                status = "unchanged"
+            counts[status] += 1
+            if on_block is not None:
+                on_block(block)
+            if on_device is not None:
+                on_device(status, *device)
+    try:
+        if changed or index.duplicates:
+            rewrite_export_file(index, changed, new_blocks_path)
+        elif counts["new"]:
+            with open(new_blocks_path, 'rb') as source, open(export_zero_config_csv_file_path, 'ab') as target:
+                shutil.copyfileobj(source, target, write_buffer_size)
+        index.update()
+        index.save()
+    finally:
+        os.remove(new_blocks_path)
+    return counts
+
+# Function to flatten a device config into {field: value}. Device Start columns are named after their
+# header, settings rows after their element and entity name, e.g. "IPAddressMode.DNSServer1_1".
+def config_fields(config):
+    fields = {}
+    for section, rows in config.items():
+        header = None
+        for row in rows[1:]:
+            if not row:
+                continue
+            values = row.split(",")
+            if header is None:
+                header = values
+            elif section == "device_start":
+                fields.update(zip(header[1:], values[1:]))
+            elif len(values) >= 5:
+                fields[f"{values[1]}.{values[3]}"] = values[4]
+    return fields
+
+# Function to list the fields that differ between two configs as {field: [old, new]}
+def diff_configs(old_config, new_config):
+    old_fields = config_fields(old_config)
+    new_fields = config_fields(new_config)
+    return {field: [old_fields.get(field), new_fields.get(field)]
+            for field in sorted(old_fields.keys() | new_fields.keys()) if old_fields.get(field) != new_fields.get(field)}
+
+# Function to work out what an upsert of the devices would change in an export file without writing
+# anything. Devices are classified by comparing the digest of their rendered block with the digest
+# in the export index, only the changed ones are read back and diffed field by field.
+def plan_config_changes(index, devices, render):
+    plan = {"new": [], "changed": {}, "unchanged": []}
+    changed_configs = {}
+    for device in devices:
+        config = render(*device)
+        entry = index.blocks.get(device[0])
+        if entry is None:
+            plan["new"].append(device[0])
+        elif entry[2] == block_digest(config_to_block(config).encode()):
+            plan["unchanged"].append(device[0])
+        else:
+            changed_configs[device[0]] = config
+    for mac, block in index.read_blocks(changed_configs):
+        plan["changed"][mac] = diff_configs(parse_export_block(block), changed_configs[mac])
+    return plan
+
+# Function to print a plan through log as a summary, or as JSON when as_json is set
+def print_plan(site, plan, as_json=False, log=print):
+    if as_json:
+        log(json.dumps({"site": site, **plan}, indent=2))
+        return
+    log(f"\nPlan for site '{site}': {len(plan['new'])} new, {len(plan['changed'])} changed, "
+        f"{len(plan['unchanged'])} unchanged, {len(plan['conflicting'])} conflicting devices.")
+    if plan["changed"]:
+        log("\nChanged devices:")
+        for mac, fields in plan["changed"].items():
+            log(f"MAC Address: {mac} - " + ", ".join(f"{field}: {old} -> {new}" for field, (old, new) in fields.items()))
+    if plan["conflicting"]:
+        log("\nConflicting devices:")
+        for mac, reason in plan["conflicting"].items():
+            log(f"MAC Address: {mac} - {reason}")
+    log("\nNothing was written, run again with --upsert to apply the plan.")
+
+# Error raised by run_site when a site can't be provisioned with the given inputs
+class KgzcfgError(Exception):
+    pass
+
+# Function to provision one site: filter the MAC addresses against the MAC index, hand out accounts
+# and IP addresses, and write the export file and the deployment records. Every input must already
+# be given, nothing is prompted for. Messages go through log, which is called like print, and
+# on_device(mac, account, ip) is called for every device written. accounts, an AccountPool or a range
+# expression such as "1000-1099,!1050", replaces account.txt and start_account. With workers above 1,
+# a site of min_shard_site_devices or more is rendered in parallel by the worker processes of executor,
+# or of a pool started for the run. progress, a ProgressReporter, follows the devices as they are
+# written, and profiler, a StageProfiler, times its stages. on_block(mac, account, ip, block) is
+# called like on_device, with the device's block of the export file as well; such a site is not
+# rendered in shards. cache, a SiteCache, keeps the site set up and its deployment records in memory
+# for the next run. With write_xml, every device written also gets a cfg<MAC>.xml file in the site's
+# xml folder. file_url replaces the UCM's zero config URL as the URL the devices fetch their config
+# from. Returns a summary of the run, which also holds the plan when plan or plan_json_path is set.
+def run_site(site, mac_addresses, model, ucm_ip, ip_mode, start_ip="", subnet_mask="255.255.255.0", gateway_ip="", dns_ip="8.8.8.8",
+             start_account="", reprovision=False, write_jsonl=False, fsync_policy="none", atomic=False, upsert=False,
+             plan=False, plan_json_path="", base_directory=None, accounts=None, log=print, on_device=None, workers=1, executor=None, progress=None,
+             profiler=None, cache=None, write_xml=False, file_url="", on_block=None):
+    if model not in supported_model_list:
+        raise KgzcfgError(f"Unsupported model '{model}'.")
+    if str(ip_mode) not in ("1", "2"):
+        raise KgzcfgError(f"Invalid IP mode '{ip_mode}', use 1 for DHCP or 2 for Static.")
+    ip_mode = int(ip_mode)
+    if start_account != "" and (isinstance(start_account, bool) or not str(start_account).isdigit()):
+        raise KgzcfgError(f"Invalid starting Account number '{start_account}'.")
+    if fsync_policy not in fsync_policies:
+        raise KgzcfgError(f"Invalid fsync policy '{fsync_policy}', use one of: {', '.join(fsync_policies)}.")
+    if upsert and atomic and not (plan or plan_json_path):
+        raise KgzcfgError("Upsert can't be combined with atomic, upsert already replaces the export file atomically.")
+    if ip_mode == 2 and not start_ip:
+        raise KgzcfgError("A starting IP address is needed for Static IP mode.")
+    if ip_mode == 2 and not gateway_ip:
+        gateway_ip = start_ip.rsplit(".", 1)[0] + ".1"
+    addresses = [("UCM IP address", ucm_ip)]
+    if ip_mode == 2:
+        addresses += [("starting IP address", start_ip), ("Gateway IP address", gateway_ip), ("DNS IP address", dns_ip)]
+        if not is_valid_subnet_mask(subnet_mask):
+            raise KgzcfgError(f"Invalid Subnet Mask '{subnet_mask}'.")
+    for name, ip in addresses:
+        if not is_valid_ip(ip):
+            raise KgzcfgError(f"Invalid {name} '{ip}'.")
+    if file_url and not re.match(r"^(https?|tftp|ftp)://[^\s,\"]+$", file_url):
+        raise KgzcfgError(f"Invalid config file URL '{file_url}', use an http, https, tftp or ftp URL without commas or quotes.")
+    if not isinstance(mac_addresses, MacTable):
+        valid_macs, invalid_macs = mac_processing(mac_addresses)
+        if invalid_macs:
+            raise KgzcfgError("Invalid MAC addresses: " + ", ".join(invalid_macs))
+        mac_addresses = MacTable(valid_macs)
+    if isinstance(accounts, str):
+        try:
+            accounts = AccountPool.from_expression(accounts)
+        except ValueError as error:
+            raise KgzcfgError(str(error))
+    result = {"site": site, "devices": 0, "repeated": 0, "skipped": 0}
+    if profiler is None:
+        profiler = StageProfiler(enabled=False)
+
+    # A plan describes what --upsert would do and must not create or change anything. Neither does a
+    # run until the site is known to fit its account pool and subnet, the output is only created then.
+    profiler.begin("site_paths")
+    planning = plan or bool(plan_json_path)
+    if planning:
+        upsert = True
+        atomic = False
+    path = get_site_paths(site, base_directory)
+    export_zero_config_csv_file_path, mac_file_path, deployment_file_path, account_file_path, mac_index_path, reserved_file_path, deployment_jsonl_file_path, journal_file_path, xml_directory_path = path
+    mac_index_exists = os.path.exists(mac_index_path) or os.path.exists(journal_file_path)
+    mac_index = open_mac_index(mac_index_path, read_only=planning or not mac_index_exists)
+
+    # Record the devices of committed --atomic output in the MAC index
+    def record_committed_devices(part_paths):
+        record_provisioned_macs(mac_index, site, iter_deployment_records(part_paths[1]))
+
+    # Finish the commit of an --atomic run that was interrupted while committing
+    if planning:
+        pass
+    elif finish_output_commit(journal_file_path, record_committed_devices):
+        log("Finished committing the output of an interrupted --atomic run.")
+    elif not atomic and read_journal(journal_file_path):
+        log("Found the journal of an interrupted --atomic run, run again with --atomic and the same inputs to resume it.")
+
+    # Drop repeated MAC addresses and the ones already provisioned in this or another site
+    profiler.begin("unique")
+    conflicts = {}
+    unique_macs = mac_addresses.unique()
+    if len(unique_macs) != len(mac_addresses):
+        result["repeated"] = len(mac_addresses) - len(unique_macs)
+        log(f"Skipped {result['repeated']} repeated MAC addresses.")
+    mac_addresses = unique_macs
+    profiler.begin("mac_index_lookup")
+    provisioned = lookup_provisioned_macs(mac_index, mac_addresses)
+    if upsert:
+        # Devices of this site are updated in place, only other sites' devices are already provisioned
+        provisioned = {mac: record for mac, record in provisioned.items() if record[0] != site}
+    if provisioned:
+        log("\nAlready provisioned MAC addresses:")
+        for mac in sorted(provisioned):
+            provisioned_site, account, ip, provisioned_at = provisioned[mac]
+            log(f"MAC Address: {int_to_mac(mac)} - Site: {provisioned_site} - IP: {ip or 'DHCP'} - Account: {account} - On: {provisioned_at}")
+        if reprovision:
+            log("Re-provisioning them as requested.")
+        else:
+            log("Skipping them, use -r to provision them again.")
+            mac_addresses = MacTable(mac for mac in mac_addresses if mac_to_int(mac) not in provisioned)
+            conflicts = {int_to_mac(mac): f"Already provisioned in site '{record[0]}'" for mac, record in provisioned.items()}
+            result["skipped"] = len(provisioned)
+        log()
+    if not len(mac_addresses) and not planning:
+        log("No new MAC addresses to provision.")
+        mac_index.close()
+        profiler.end()
+        return result
+
+    # In upsert mode, devices already deployed in this site keep their account and IP address
+    profiler.begin("site_records")
+    site_devices = {}
+    site_accounts = set()
+    site_records = {}
+    deployment_records = iter_deployment_records(deployment_file_path) if cache is None else cache.deployment_index(deployment_file_path).records
+    if upsert:
+        wanted = mac_addresses.as_set()
+        for mac, account, ip in deployment_records:
+            if account.isdigit():
+                site_accounts.add(int(account))
+            site_records[mac] = (account, ip)
+            if mac_to_int(mac) in wanted:
+                site_devices[mac] = (account, ip)
+        if site_devices:
+            log(f"Updating {len(site_devices)} devices already deployed in site '{site}'.")
+    new_device_count = len(mac_addresses) - len(site_devices)
+
+    profiler.begin("accounts")
+    if accounts is None:
+        try:
+            accounts = load_account_pool(account_file_path, log)
+            log("Accounts successfully read from account.txt")
+        except OSError:
+            log(f"'{account_file_path}' not found in the same folder as the script.")
+            if start_account == "":
+                mac_index.close()
+                raise KgzcfgError(f"No '{account_file_path}' and no starting Account number given.")
+            width = len(str(start_account)) if str(start_account).startswith("0") else 0
+            accounts = generate_account_numbers(int(start_account), new_device_count + len(site_accounts), width)
+    if site_accounts:
+        # Accounts already used in the site are not handed out to new devices
+        accounts = AccountPool(accounts.intervals, [(account, account) for account in site_accounts])
+    log(accounts)
+    log()
+
+    profiler.begin("ip_allocation")
+    if ip_mode == 2:
+        try:
+            # Seed the allocator with the addresses earlier runs and the reserved ranges already use
+            allocator = SubnetAllocator(start_ip, subnet_mask, gateway_ip)
+            taken = allocator.used.count(1)
+            if cache is None:
+                for ip in load_deployment_ips(deployment_file_path):
+                    allocator.reserve(ip)
+            else:
+                allocator = cache.deployment_index(deployment_file_path).allocator(start_ip, subnet_mask, gateway_ip)
+            reserved_ranges = list(load_reserved_ranges(reserved_file_path, log))
+            for first_ip, last_ip in reserved_ranges:
+                allocator.reserve_range(first_ip, last_ip)
+            taken = allocator.used.count(1) - taken
+            if taken:
+                log(f"Skipping {taken} IP addresses already assigned or reserved in subnet {allocator.network}.")
+            ip_count = len(mac_addresses) - sum(1 for account, ip in site_devices.values() if ip is not None)
+            ips = generate_ip_range(start_ip, ip_count, allocator=allocator)
+        except ValueError as error:
+            mac_index.close()
+            raise KgzcfgError(str(error))
+
+    if len(accounts) < new_device_count:
+        mac_index.close()
+        raise KgzcfgError(f"Found number of MAC address and Account Number does not match. Numebr of MAC Address Found: {new_device_count} Number of Accounts Found: {len(accounts)}")
+    if len(accounts) > new_device_count:
+        accounts = accounts.take(new_device_count)
+        log(f"Using the first {len(accounts)} accounts of the account pool: {accounts}")
+
+    # The site fits, create its folder, output files and the MAC index
+    if not planning:
+        profiler.begin("site_paths")
+        if cache is not None:
+            cache.config_paths(site, base_directory, log)
+        else:
+            get_config_file(site, base_directory, log)
+        if not mac_index_exists:
+            mac_index.close()
+            mac_index = open_mac_index(mac_index_path)
+
+    # With --atomic, write to part files through a journal and resume an interrupted identical run
+    target_paths = [export_zero_config_csv_file_path, deployment_file_path]
+    if write_jsonl:
+        target_paths.append(deployment_jsonl_file_path)
+    transaction = None
+    skip_devices = 0
+    if atomic:
+        run_inputs = [site, model, ucm_ip, ip_mode, start_ip, subnet_mask, gateway_ip, dns_ip, str(accounts)]
+        run_inputs += [os.path.getsize(path) if os.path.exists(path) else 0 for path in target_paths]
+        import hashlib
+        fingerprint = hashlib.sha256(mac_addresses.values.tobytes() + json.dumps(run_inputs).encode()).hexdigest()
+        transaction = OutputTransaction(journal_file_path, target_paths, fingerprint)
+        skip_devices = transaction.begin()
+        if skip_devices:
+            log(f"Resuming an interrupted run after {skip_devices} devices already written.")
+        output_paths = transaction.part_paths
+        fsync_policy = "batch"
+    else:
+        output_paths = target_paths
+
+    # Stream every device through rendering, the CSV writer and the deployment report one at a
+    # time, so only one device block is held in memory and the first rows reach disk right away
+    provisioned_records = []
+    xml_writer = None
+    rendered_block = [None]  # block of the device being recorded, for on_block
+
+    def record_device(mac, account, ip, write_record=True):
+        if write_record:
+            deployment_sink.write(mac, account, ip)
+        if xml_writer is not None:
+            xml_writer.write(mac, account, ip)
+        result["devices"] += 1
+        if progress is not None:
+            progress.advance()
+        if on_device:
+            on_device(mac, account, ip)
+        if on_block is not None:
+            on_block(mac, account, ip, rendered_block[0])
+        if atomic:
+            return  # Recorded in the MAC index when the output is committed
+        provisioned_records.append((mac, account, ip))
+        if len(provisioned_records) >= mac_index_batch_size:
+            record_provisioned_macs(mac_index, site, provisioned_records)
+            provisioned_records.clear()
+
+    def report_dhcp_device(mac, account):
+        log(f"MAC Address: {mac} - Account: {account}")
+        record_device(mac, account, None)
+
+    def report_static_device(mac, ip, account):
+        log(f"MAC Address: {mac} - IP: {ip} - Account: {account}")
+        record_device(mac, account, ip)
+
+    # Make the written chunk and its deployment records durable, then move the journal checkpoint
+    def checkpoint(file, devices):
+        file.flush()
+        os.fsync(file.fileno())
+        deployment_sink.flush()
+        transaction.checkpoint(devices)
+
+    # Devices already deployed in the site take their recorded account and IP address, the others
+    # the next ones from the account pool and the IP allocator
+    def iter_site_devices(new_ips):
+        new_accounts = iter(accounts)
+        for mac in mac_addresses:
+            account, ip = site_devices.get(mac, (None, None))
+            if account is None:
+                account = next(new_accounts)
+            if ip_mode == 1:
+                yield mac, account
+            else:
+                yield mac, ip if ip is not None else next(new_ips), account
+
+    template = ("dhcp", model, ucm_ip, file_url) if ip_mode == 1 else ("static", model, ucm_ip, dns_ip, subnet_mask, gateway_ip, file_url)
+    if ip_mode == 1:
+        log("\nAssigned MAC Address to Accounts:")
+        render = compile_template(template)
+        devices = iter_site_devices(None) if upsert else zip(mac_addresses, accounts)
+        report_device = report_dhcp_device
+    if ip_mode == 2:
+        log("\nAssigned IPs and Accounts:")
+        render = compile_template(template)
+        devices = iter_site_devices(ips) if upsert else zip(mac_addresses, ips, accounts)
+        report_device = report_static_device
+    render = profiler.wrap("render", render)
+    report_device = profiler.wrap("record", report_device)
+
+    if planning:
+        profiler.begin("plan")
+        # Devices whose recorded IP address no longer fits, is reserved or is shared with another device conflict
+        if ip_mode == 2:
+            ip_owners = {}
+            for mac, (account, ip) in site_records.items():
+                ip_owners.setdefault(ip, []).append(mac)
+            reserved = [(int(ipaddress.IPv4Address(first_ip)), int(ipaddress.IPv4Address(last_ip)))
+                        for first_ip, last_ip in reserved_ranges]
+            for mac, (account, ip) in site_devices.items():
+                if ip is None:
+                    continue
+                if ipaddress.IPv4Address(ip) not in allocator.network:
+                    conflicts[mac] = f"IP {ip} is outside subnet {allocator.network}"
+                elif any(first <= int(ipaddress.IPv4Address(ip)) <= last for first, last in reserved):
+                    conflicts[mac] = f"IP {ip} is in a reserved range"
+                elif len(ip_owners[ip]) > 1:
+                    conflicts[mac] = f"IP {ip} is also assigned to " + ", ".join(owner for owner in ip_owners[ip] if owner != mac)
+        plan_result = plan_config_changes(ExportIndex(export_zero_config_csv_file_path).load(save=False), devices, render)
+        plan_result["new"] = [mac for mac in plan_result["new"] if mac not in conflicts]
+        plan_result["unchanged"] = [mac for mac in plan_result["unchanged"] if mac not in conflicts]
+        plan_result["changed"] = {mac: fields for mac, fields in plan_result["changed"].items() if mac not in conflicts}
+        plan_result["conflicting"] = conflicts
+        if plan:
+            print_plan(site, plan_result, log=log)
+        if plan_json_path == "-":
+            print_plan(site, plan_result, as_json=True)  # On stdout itself, not through log
+        elif plan_json_path:
+            with open(plan_json_path, "w") as file:
+                json.dump({"site": site, **plan_result}, file, indent=2)
+            log(f"Plan written to '{plan_json_path}'.")
+        result["plan"] = plan_result
+        mac_index.close()
+        profiler.end()
+        return result
+
+    deployment_sink = DeploymentSink(output_paths[1], output_paths[2] if write_jsonl else None,
+                                     site=site, fsync_policy=fsync_policy)
+    if write_xml:
+        xml_render = compile_xml_template(ucm_ip) if ip_mode == 1 else compile_xml_template(ucm_ip, dns_ip, subnet_mask, gateway_ip)
+        xml_writer = XmlConfigWriter(xml_directory_path, xml_render, fsync=fsync_policy != "none")
+    xml_output = xml_writer if xml_writer is not None else contextlib.nullcontext()
+
+    if upsert:
+        # New and changed devices are recorded as usual, a changed one only gets a new deployment record
+        # when its account or IP address changed. Unchanged devices get their XML file written again.
+        def report_upserted_device(status, mac, *device):
+            if status == "new":
+                report_device(mac, *device)
+                return
+            ip, account = device if ip_mode == 2 else (None, device[0])
+            if status == "changed":
+                log(f"Updated MAC Address: {mac}")
+                record_device(mac, account, ip, (account, ip) != site_devices[mac])
+                return
+            if progress is not None:
+                progress.advance()
+            if xml_writer is not None:
+                xml_writer.write(mac, account, ip)
+
+        def keep_block(block):
+            rendered_block[0] = block.decode()
+
+        if progress is not None:
+            progress.start(f"Updating {site}", len(mac_addresses))
+        profiler.begin("upsert")
+        with deployment_sink, xml_output:
+            counts = upsert_config_to_csv(export_zero_config_csv_file_path, devices, render, profiler.wrap("record", report_upserted_device),
+                                          keep_block if on_block is not None else None)
+        if progress is not None:
+            progress.finish()
+        log(f"\nNew devices: {counts['new']} - Changed devices: {counts['changed']} - Unchanged devices: {counts['unchanged']}")
+        profiler.begin("mac_index_update")
+        record_provisioned_macs(mac_index, site, provisioned_records)
+        result.update(counts)
+        mac_index.close()
+        profiler.end()
+        return result
+
+    profiler.begin("write")
+    if xml_writer is not None and skip_devices:
+        # The XML files of the devices written before an --atomic run was interrupted may be missing
+        for device in itertools.islice(devices, skip_devices):
+            xml_writer.write(device[0], device[-1], device[1] if ip_mode == 2 else None)
+    else:
+        devices = itertools.islice(devices, skip_devices, None)
+    if progress is not None:
+        progress.start(f"Writing {site}", len(mac_addresses) - skip_devices)
+
+    try:
+        with deployment_sink, xml_output:
+            if workers > 1 and len(mac_addresses) - skip_devices >= min_shard_site_devices and on_block is None:
+                # Large sites are rendered in shards by worker processes, the writes stay in this one
+                if executor is None:
+                    from concurrent.futures import ProcessPoolExecutor
+                    pool = ProcessPoolExecutor(workers)
+                else:
+                    pool = contextlib.nullcontext(executor)
+                with pool as executor:
+                    append_shards_to_csv(output_paths[0], devices, template, executor, workers, report_device, checkpoint if atomic else None)
+            elif on_block is not None:
+                # The blocks are made before their devices are recorded, so on_block gets the block written
+                def iter_blocks():
+                    for device in devices:
+                        rendered_block[0] = config_to_block(render(*device))
+                        report_device(*device)
+                        yield rendered_block[0]
+
+                append_config_to_csv(output_paths[0], iter_blocks(), checkpoint if atomic else None)
+            else:
+                configs = stream_configs(devices, render, report_device)
+                append_config_to_csv(output_paths[0], configs, checkpoint if atomic else None)
+    except KeyboardInterrupt:
+        if atomic:
+            log(f"\nInterrupted after {transaction.devices} devices, run again with --atomic and the same inputs to resume.")
+        raise
+    if progress is not None:
+        progress.finish()
+    profiler.begin("mac_index_update")
+    if atomic:
+        transaction.commit(record_committed_devices)
+    record_provisioned_macs(mac_index, site, provisioned_records)
+    mac_index.close()
+    profiler.end()
+    return result
+
+# Keys a site of a job file may set. mac_file and account_file are read for the site, the others are
+# passed to run_site as they are.
+job_site_keys = ("site", "model", "ucm_ip", "ip_mode", "start_ip", "subnet_mask", "gateway_ip", "dns_ip", "start_account",
+                 "accounts", "account_file", "macs", "mac_file", "reprovision", "write_jsonl", "write_xml", "fsync_policy", "atomic",
+                 "upsert", "file_url")
+job_required_keys = ("site", "model", "ucm_ip", "ip_mode")
+
+# Keys of a job site that must hold text, and the ones that must be true or false
+job_text_keys = ("site", "ucm_ip", "start_ip", "subnet_mask", "gateway_ip", "dns_ip", "accounts", "account_file", "mac_file",
+                 "fsync_policy", "file_url")
+job_flag_keys = ("reprovision", "write_jsonl", "write_xml", "atomic", "upsert")
+
+# Function to read a JSON or TOML job file into the list of its sites with parse_job_spec
+def load_job_file(job_file_path):
+    try:
+        if job_file_path.endswith(".toml"):
+            import tomllib
+            with open(job_file_path, "rb") as file:
+                spec = tomllib.load(file)
+        else:
+            with open(job_file_path, "r") as file:
+                spec = json.load(file)
+    except ImportError:
+        raise KgzcfgError("TOML job files need Python 3.11 or newer, use a JSON job file instead.")
+    except (OSError, ValueError) as error:
+        raise KgzcfgError(f"Can't read job file '{job_file_path}': {error}")
+    return parse_job_spec(spec, f"'{job_file_path}'", os.path.dirname(os.path.abspath(job_file_path)))
+
+# Function to check the values of a job site, so a bad value is reported before any site runs
+# instead of failing deep in run_site. name names the site in the error messages.
+def check_job_values(job, name):
+    for key in job_text_keys:
+        if key in job and not isinstance(job[key], str):
+            raise KgzcfgError(f"{name} must give {key} as text")
+    for key in job_flag_keys:
+        if key in job and not isinstance(job[key], bool):
+            raise KgzcfgError(f"{name} must give {key} as true or false")
+    if str(job["ip_mode"]) not in ("1", "2"):
+        raise KgzcfgError(f"{name} has an invalid ip_mode '{job['ip_mode']}', use 1 for DHCP or 2 for Static")
+    start_account = job.get("start_account", "")
+    if start_account != "" and (isinstance(start_account, bool) or not str(start_account).isdigit()):
+        raise KgzcfgError(f"{name} has an invalid start_account '{start_account}', use a whole number")
+    if job.get("upsert") and job.get("atomic"):
+        raise KgzcfgError(f"{name} can't combine upsert with atomic, upsert already replaces the export file atomically")
+    if job.get("fsync_policy", "none") not in fsync_policies:
+        raise KgzcfgError(f"{name} has an invalid fsync_policy '{job['fsync_policy']}', use one of: {', '.join(fsync_policies)}")
+    if "macs" in job and (not isinstance(job["macs"], list) or not all(isinstance(mac, str) for mac in job["macs"])):
+        raise KgzcfgError(f"{name} must give macs as a list of MAC addresses")
+
+# Function to check a job spec, {"defaults": {...}, "sites": [{...}, ...]}, and return the list of its
+# sites. Every site is merged over the defaults, and mac_file and account_file paths are taken
+# relative to directory. source names the spec in the error messages.
+def parse_job_spec(spec, source, directory):
+    if not isinstance(spec, dict) or not isinstance(spec.get("sites", []), list) or not isinstance(spec.get("defaults", {}), dict):
+        raise KgzcfgError(f"The job spec of {source} must hold a list of sites and a table of defaults")
+    defaults = spec.get("defaults", {})
+    jobs = []
+    sites = set()
+    for number, site_spec in enumerate(spec.get("sites", []), 1):
+        if not isinstance(site_spec, dict):
+            raise KgzcfgError(f"Site {number} of {source} is not a table of settings")
+        job = {**defaults, **site_spec}
+        unknown = sorted(set(job) - set(job_site_keys))
+        if unknown:
+            raise KgzcfgError(f"Site {number} of {source} has unknown keys: {', '.join(unknown)}")
+        missing = [key for key in job_required_keys if not job.get(key)]
+        if missing:
+            raise KgzcfgError(f"Site {number} of {source} is missing: {', '.join(missing)}")
+        check_job_values(job, f"Site {number} of {source}")
+        if job["site"] in sites:
+            raise KgzcfgError(f"Site '{job['site']}' is listed twice in {source}")
+        sites.add(job["site"])
+        job["model"] = str(job["model"]).upper()
+        for key in ("mac_file", "account_file"):
+            if key in job:
+                job[key] = os.path.join(directory, job[key])
+        jobs.append(job)
+    return jobs
+
+# Function to read the MAC addresses of a job, from its mac_file or its macs list, returning them in a
+# MacTable with the invalid ones
+def load_job_macs(job):
+    if "mac_file" in job:
+        try:
+            return load_mac_file(job["mac_file"])
+        except OSError as error:
+            raise KgzcfgError(str(error))
+    valid_macs, invalid_macs = mac_processing(job.get("macs", []))
+    return MacTable(valid_macs), invalid_macs
+
+# Function to run one site of a job file, returning the run_site summary with the number of invalid
+# MAC addresses. macs, the result of load_job_macs, saves reading them again.
+def run_job(job, base_directory=None, log=print, macs=None, workers=1, executor=None, cache=None):
+    job = dict(job)
+    site = job.pop("site")
+    mac_addresses, invalid_macs = macs or load_job_macs(job)
+    job.pop("mac_file", None)
+    job.pop("macs", None)
+    if "account_file" in job:
+        try:
+            job["accounts"] = load_account_pool(job.pop("account_file"), log)
+        except OSError as error:
+            raise KgzcfgError(str(error))
+    if not len(mac_addresses):
+        raise KgzcfgError("No valid MAC addresses found.")
+    result = run_site(site, mac_addresses, base_directory=base_directory, log=log, workers=workers, executor=executor, cache=cache, **job)
+    result["invalid"] = len(invalid_macs)
+    return result
+
+# Function to run one site of a job file and time it. A failing site's summary holds the error.
+def run_timed_job(job, base_directory=None, log=print, macs=None, workers=1, executor=None, cache=None):
+    start = time.perf_counter()
+    try:
+        result = run_job(job, base_directory, log, macs, workers, executor, cache)
+        result["status"] = "ok"
+    except (KgzcfgError, OSError) as error:
+        result = {"site": job["site"], "status": "error", "error": str(error)}
+    result["seconds"] = round(time.perf_counter() - start, 3)
+    return result
+
+# Function to format the summary of a site run by run_timed_job as one line
+def format_job_result(result):
+    if result["status"] == "ok":
+        return (f"Site {result['site']}: {result['devices']} devices written, {result['repeated']} repeated, "
+                f"{result['skipped']} already provisioned, {result['invalid']} invalid MAC addresses ({result['seconds']}s)")
+    return f"Site {result['site']}: failed - {result['error']}"
+
+# Function to drop the messages of sites run in worker processes
+def silent_log(*args):
+    pass
+
+# Function run in a worker process to run a group of sites one after the other
+def run_job_group(jobs, macs, base_directory=None):
+    return [run_timed_job(job, base_directory, silent_log, job_macs) for job, job_macs in zip(jobs, macs)]
+
+# Function to split jobs into groups of sites that share MAC addresses. The sites of a group must run
+# one after the other to see each other's MAC index records, separate groups can run in parallel.
+def group_jobs(macs):
+    groups = list(range(len(macs)))
+
+    def find(group):
+        while groups[group] != group:
+            groups[group] = groups[groups[group]]
+            group = groups[group]
+        return group
+
+    owners = {}
+    for number, job_macs in enumerate(macs):
+        for mac in job_macs[0].values if job_macs else ():
+            owner = owners.setdefault(mac, number)
+            if owner != number:
+                groups[find(number)] = find(owner)
+    members = {}
+    for number in range(len(macs)):
+        members.setdefault(find(number), []).append(number)
+    return list(members.values())
+
+# Function to run the sites of a job file. A failing site doesn't stop the others, its summary holds
+# the error instead. on_result(result) is called for every site in the order of the jobs. With workers
+# above 1 the groups of sites that share no MAC addresses run in parallel in worker processes, and the
+# groups holding a site of min_shard_site_devices or more run here with that site rendered in shards
+# by the same workers, so the output is the same as running the sites one after the other.
+def run_jobs(jobs, base_directory=None, log=print, on_result=None, workers=1):
+    results = []
+    if workers <= 1:
+        for job in jobs:
+            results.append(run_timed_job(job, base_directory, log))
+            if on_result:
+                on_result(results[-1])
+        return results
+
+    from concurrent.futures import ProcessPoolExecutor
+    macs = []
+    for job in jobs:
+        try:
+            macs.append(load_job_macs(job))
+        except KgzcfgError:
+            macs.append(None)  # Reported when the site runs
+    remote = {}
+    with ProcessPoolExecutor(workers) as executor:
+        for group in group_jobs(macs):
+            if any(macs[number] and len(macs[number][0]) >= min_shard_site_devices for number in group):
+                continue
+            future = executor.submit(run_job_group, [jobs[number] for number in group], [macs[number] for number in group], base_directory)
+            for position, number in enumerate(group):
+                remote[number] = (future, position)
+        for number, job in enumerate(jobs):
+            if number in remote:
+                future, position = remote[number]
+                result = future.result()[position]
+            else:
+                result = run_timed_job(job, base_directory, log, macs[number], workers, executor)
+            results.append(result)
+            if on_result:
+                on_result(result)
+    return results
+
+# Function to import the socket module for the job daemon, checking that it has Unix sockets
+def import_unix_socket():
+    import socket
+    if not hasattr(socket, "AF_UNIX"):
+        raise KgzcfgError("The job daemon needs Unix sockets, which this platform doesn't have.")
+    return socket
+
+# Function to run the job daemon, serving job requests on the Unix socket socket_path until it is
+# interrupted. A request is one line holding a JSON job spec, {"defaults": {...}, "sites": [...]} as in
+# a job file, and is answered with one line holding {"results": [...]} with the run_timed_job summary
+# of every site, or {"error": "..."} when the spec is invalid. A connection can send any number of
+# requests. Connections are served in threads, but the jobs run one at a time in this process, which
+# keeps a SiteCache and the compiled templates warm between them. With workers above 1, large sites
+# are rendered by a pool of worker processes started with the daemon. Relative mac_file and
+# account_file paths are taken relative to base_directory or the current directory.
+def serve_jobs(socket_path, base_directory=None, log=print, workers=1):
+    socket = import_unix_socket()
+    import socketserver
+    if os.path.exists(socket_path):
+        # A socket left by a daemon that didn't stop cleanly is replaced, a running daemon is not
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(socket_path)
+            raise KgzcfgError(f"A job daemon is already serving '{socket_path}'.")
+        except (ConnectionRefusedError, FileNotFoundError):
+            os.remove(socket_path)
+        finally:
+            probe.close()
+    cache = SiteCache()
+    run_lock = threading.Lock()
+    directory = os.path.abspath(base_directory or os.getcwd())
+    executor = None
+    if workers > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        executor = ProcessPoolExecutor(workers)
+
+    class JobRequestHandler(socketserver.StreamRequestHandler):
+        def handle(self):
+            for line in self.rfile:
+                if not line.strip():
+                    continue
+                try:
+                    jobs = parse_job_spec(json.loads(line), "the request", directory)
+                except ValueError as error:
+                    response = {"error": f"Invalid JSON request: {error}"}
+                except KgzcfgError as error:
+                    response = {"error": str(error)}
+                else:
+                    with run_lock:
+                        results = [run_timed_job(job, base_directory, silent_log, None, workers, executor, cache) for job in jobs]
+                    for result in results:
+                        log(format_job_result(result))
+                    response = {"results": results}
+                self.wfile.write(json.dumps(response).encode() + b"\n")
+
+    class JobServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+
+    server = JobServer(socket_path, JobRequestHandler)
+    if threading.current_thread() is threading.main_thread():
+        # Stop on SIGTERM like on Ctrl+C, so the socket is removed
+        import signal
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+    log(f"Serving job requests on '{socket_path}'.")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if executor is not None:
+            executor.shutdown()
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+
+# Function to send a job spec to the job daemon on socket_path and return the summaries of its sites
+def submit_jobs(socket_path, spec):
+    socket = import_unix_socket()
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(socket_path)
+    except OSError as error:
+        client.close()
+        raise KgzcfgError(f"Can't reach the job daemon on '{socket_path}': {error}")
+    with client, client.makefile("rwb") as stream:
+        stream.write(json.dumps(spec).encode() + b"\n")
+        stream.flush()
+        line = stream.readline()
+    if not line:
+        raise KgzcfgError(f"The job daemon on '{socket_path}' closed the connection without an answer.")
+    response = json.loads(line)
+    if "error" in response:
+        raise KgzcfgError(response["error"])
+    return response["results"]
+
+# Largest request body taken by the HTTP API, devices sent with one chunk of a streamed response, and
+# chunks queued before a run waits for the client to read them
+http_max_body_size = 64 << 20
+http_stream_devices = 100
+http_stream_queue_size = 8
+
+http_reasons = {200: "OK", 304: "Not Modified", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 411: "Length Required",
+                413: "Payload Too Large", 422: "Unprocessable Entity", 500: "Internal Server Error"}
+
+# Error in an HTTP request that can't be taken, answered with status before the connection is closed
+class HttpError(KgzcfgError):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+# Function to read one HTTP request from an asyncio stream, returning (method, path, headers, body,
+# keep_alive), or None when the client closed the connection. Header names are lower case and the
+# query string is dropped from the path.
+async def read_http_request(reader):
+    try:
+        request_line = await reader.readline()
+        if not request_line.strip():
+            return None
+        parts = request_line.decode("latin-1").split()
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+    except ValueError:
+        # A line longer than the stream limit
+        raise HttpError(400, "Request line or header too long.")
+    if len(parts) != 3:
+        raise HttpError(400, "Invalid request line.")
+    method, target, http_version = parts
+    connection = headers.get("connection", "").lower()
+    keep_alive = connection == "keep-alive" or (http_version == "HTTP/1.1" and connection != "close")
+    if "transfer-encoding" in headers:
+        raise HttpError(411, "Send the request body with a Content-Length.")
+    try:
+        length = int(headers.get("content-length", "0"))
+    except ValueError:
+        length = -1
+    if not 0 <= length <= http_max_body_size:
+        raise HttpError(413, f"The request body must hold at most {http_max_body_size} bytes.")
+    body = await reader.readexactly(length)
+    return method, target.split("?", 1)[0], headers, body, keep_alive
+
+# Function to build a complete HTTP response holding data as JSON
+def http_json_response(status, data, keep_alive=True):
+    body = json.dumps(data).encode() + b"\n"
+    head = (f"HTTP/1.1 {status} {http_reasons[status]}\r\nContent-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+    return head.encode() + body
+
+# Function to run the HTTP API on host and port until it is interrupted. POST /sites/<site> takes the
+# settings of one site of a job file as a JSON object, with the MAC addresses in macs, and provisions
+# it. The answer streams one JSON line per device written, {"mac", "account", "ip", "block"} with the
+# device's block of the export file, and ends with {"result": {...}}, the run_timed_job summary, or
+# {"error": "..."} if the run failed after devices were written. A request that fails before that is
+# answered with a 4xx status and {"error": "..."}. GET /health answers {"status": "ok", "version"}.
+# Runs go to the threads of the default executor so the event loop never waits for the disk. The runs
+# of a site are serialized, and runs of different sites holding the same MAC address wait for each
+# other, so every run sees the MAC index records of the one before.
+def serve_http(host, port, base_directory=None, log=print):
+    import asyncio
+    from urllib.parse import unquote
+
+    directory = os.path.abspath(base_directory or os.getcwd())
+    cache = SiteCache()
+
+    async def serve():
+        loop = asyncio.get_running_loop()
+        site_locks = {}
+        claimed_macs = set()
+        claims = asyncio.Condition()
+
+        # Function run in an executor thread to provision one site, putting the device lines on queue
+        # a chunk at a time and a dict with the result or the error last
+        def run_streamed(job, queue):
+            settings = dict(job)
+            site = settings.pop("site")
+            lines = []
+
+            def put(item):
+                asyncio.run_coroutine_threadsafe(queue.put(item), loop).result()
+
+            def stream_device(mac, account, ip, block):
+                lines.append(json.dumps({"mac": mac, "account": str(account), "ip": ip, "block": block}) + "\n")
+                if len(lines) >= http_stream_devices:
+                    put("".join(lines).encode())
+                    lines.clear()
+
+            start = time.perf_counter()
+            end = {"error": "The run stopped unexpectedly.", "status": 500}
+            # Anything that fails must still end up on the queue, provision waits for it
+            try:
+                result = run_site(site, settings.pop("macs", []), base_directory=base_directory, log=silent_log,
+                                  on_block=stream_device, cache=cache, **settings)
+                result.update(status="ok", invalid=0, seconds=round(time.perf_counter() - start, 3))
+                end = {"result": result}
+            except KgzcfgError as error:
+                end = {"error": str(error), "status": 422}
+            except Exception as error:
+                end = {"error": f"{type(error).__name__}: {error}", "status": 500}
+            finally:
+                if lines:
+                    put("".join(lines).encode())
+                put(end)
+
+        # Function to provision one site and stream the answer to writer
+        async def provision(job, writer, keep_alive):
+            macs, invalid_macs = mac_processing(job.get("macs", []))
+            if invalid_macs:
+                writer.write(http_json_response(422, {"error": "Invalid MAC addresses: " + ", ".join(invalid_macs)}, keep_alive))
+                return None
+            keys = set(map(mac_to_int, macs))
+            lock = site_locks.setdefault(job["site"], asyncio.Lock())
+            async with lock:
+                async with claims:
+                    await claims.wait_for(lambda: claimed_macs.isdisjoint(keys))
+                    claimed_macs.update(keys)
+                try:
+                    queue = asyncio.Queue(http_stream_queue_size)
+                    run = loop.run_in_executor(None, run_streamed, job, queue)
+                    item = await queue.get()
+                    if isinstance(item, dict) and "error" in item:
+                        writer.write(http_json_response(item["status"], {"error": item["error"]}, keep_alive))
+                        await run
+                        return item
+                    writer.write((f"HTTP/1.1 200 OK\r\nContent-Type: application/x-ndjson\r\nTransfer-Encoding: chunked\r\n"
+                                  f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n").encode())
+                    # The run goes on when the client is gone, so the queue is read to the end regardless
+                    connected = True
+                    while True:
+                        if isinstance(item, dict):
+                            item.pop("status", None)
+                            data = json.dumps(item).encode() + b"\n"
+                        else:
+                            data = item
+                        if connected:
+                            try:
+                                writer.write(b"%x\r\n%s\r\n" % (len(data), data))
+                                await writer.drain()
+                            except ConnectionError:
+                                connected = False
+                        if isinstance(item, dict):
+                            break
+                        item = await queue.get()
+                    if connected:
+                        writer.write(b"0\r\n\r\n")
+                    await run
+                    return item
+                finally:
+                    async with claims:
+                        claimed_macs.difference_update(keys)
+                        claims.notify_all()
+
+        # Function to check a POST /sites/<site> request and turn it into a job
+        def parse_site_request(site, body):
+            if not site or site in (".", "..") or "/" in site or "\\" in site:
+                raise KgzcfgError(f"Invalid site name '{site}'.")
+            try:
+                settings = json.loads(body)
+            except ValueError as error:
+                raise KgzcfgError(f"Invalid JSON request: {error}")
+            if not isinstance(settings, dict):
+                raise KgzcfgError("The request must be a JSON object with the settings of the site.")
+            for key in ("mac_file", "account_file"):
+                if key in settings:
+                    raise KgzcfgError(f"'{key}' is not taken over HTTP, send the values in the request instead.")
+            return parse_job_spec({"sites": [{**settings, "site": site}]}, "the request", directory)[0]
+
+        async def handle_connection(reader, writer):
+            try:
+                while True:
+                    try:
+                        request = await read_http_request(reader)
+                    except HttpError as error:
+                        writer.write(http_json_response(error.status, {"error": str(error)}, False))
+                        break
+                    if request is None:
+                        break
+                    method, path, headers, body, keep_alive = request
+                    status = 200
+                    if path == "/health":
+                        if method == "GET":
+                            writer.write(http_json_response(200, {"status": "ok", "version": version}, keep_alive))
+                        else:
+                            status = 405
+                    elif path.startswith("/sites/"):
+                        if method == "POST":
+                            try:
+                                job = parse_site_request(unquote(path[len("/sites/"):]), body)
+                            except KgzcfgError as error:
+                                writer.write(http_json_response(400, {"error": str(error)}, keep_alive))
+                                status = 400
+                            else:
+                                end = await provision(job, writer, keep_alive)
+                                if end is not None and "result" in end:
+                                    log(format_job_result(end["result"]))
+                                elif end is not None:
+                                    log(f"Site {job['site']}: failed - {end['error']}")
+                        else:
+                            status = 405
+                    else:
+                        status = 404
+                    if status in (404, 405):
+                        writer.write(http_json_response(status, {"error": f"No {method} {path} here."}, keep_alive))
+                    await writer.drain()
+                    if not keep_alive:
+                        break
+            except (asyncio.IncompleteReadError, ConnectionError):
+                pass
+            finally:
+                writer.close()
+
+        server = await asyncio.start_server(handle_connection, host, port)
+        log(f"Serving the HTTP API on http://{host}:{port}/")
+        async with server:
+            await server.serve_forever()
+
+    asyncio.run(serve())
+
+# Configs kept in memory by the provisioning server, seconds a cached config is served before its
+# export file is checked again, and seconds between writes of the fetch log
+provisioning_cache_size = 10000
+provisioning_refresh_interval = 1.0
+provisioning_log_interval = 1.0
+
+# Request paths of per-device config files, cfg<MAC> or cfg<MAC>.xml in any folder
+provisioning_path_pattern = re.compile(r"^/(?:.*/)?cfg([0-9A-Fa-f]{12})(?:\.xml)?$")
+
+# Regular expression for the UCM's zero config URL in the file_url column of a device row
+ucm_file_url_pattern = re.compile(r"^https://([^:/]+):8089/zccgi/$")
+
+# Function to render the cfg<MAC>.xml file of a device from its block of the export file. The SIP
+# server is the UCM of the device's zero config URL, or ucm_ip when the device row holds another URL.
+def render_provisioning_xml(mac, block, ucm_ip=""):
+    fields = config_fields(parse_export_block(block))
+    match = ucm_file_url_pattern.match(fields.get("file_url", ""))
+    ucm_ip = match.group(1) if match else ucm_ip
+    if not ucm_ip:
+        raise KgzcfgError(f"No UCM for {mac}, its config file URL is '{fields.get('file_url', '')}'. Give the UCM IP with -u.")
+    if fields.get("IPAddressMode.AddressMode") != "1":
+        return compile_xml_template(ucm_ip)(mac, fields.get("Account.AccountChoice", ""))
+
+    def address(name):
+        return ".".join(fields.get(f"IPAddressMode.{name}_{i}", "") for i in range(1, 5))
+
+    render = compile_xml_template(ucm_ip, address("DNSServer1"), address("SubnetMask"), address("Gateway"))
+    return render(mac, fields.get("Account.AccountChoice", ""), fields.get("ip", ""))
+
+# LRU cache of the rendered cfg<MAC>.xml files of all sites, for the provisioning server. A MAC is
+# looked up in the MAC index to find its site, and its block is read through the site's export index.
+# Entries hold the digest of the block they were rendered from, so an entry is only rendered again
+# when the device's block changed. get is called from many threads at once: the MAC index connection
+# is per thread and the export index of a site is refreshed under the site's lock.
+class ProvisioningCache:
+    def __init__(self, base_directory=None, ucm_ip="", size=provisioning_cache_size):
+        self.base_directory = base_directory
+        self.ucm_ip = ucm_ip
+        self.size = size
+        self.entries = collections.OrderedDict()  # mac -> [site, digest, body, checked_at]
+        self.lock = threading.Lock()
+        self.site_indexes = {}                     # site -> [ExportIndex, lock, checked_at]
+        self.local = threading.local()
+        self.hits = 0
+        self.renders = 0
+
+    # Function to get the cached entry of mac if it was checked less than provisioning_refresh_interval ago
+    def get_fresh(self, mac):
+        with self.lock:
+            entry = self.entries.get(mac)
+            if entry is None or time.monotonic() - entry[3] >= provisioning_refresh_interval:
+                return None
+            self.entries.move_to_end(mac)
+            self.hits += 1
+            return entry
+
+    # Function to find the site a MAC was last provisioned to, or None
+    def find_site(self, mac):
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            mac_index_path = get_site_paths("", self.base_directory)[4]
+            if not os.path.exists(mac_index_path):
+                return None
+            connection = self.local.connection = open_mac_index(mac_index_path, read_only=True)
+        record = lookup_provisioned_macs(connection, [mac]).get(mac_to_int(mac))
+        return None if record is None else record[0]
+
+    # Function to read the block of a MAC from the export file of a site, bringing the site's export
+    # index up to date at most every provisioning_refresh_interval. Returns (digest, block), with block
+    # None when the digest is still known_digest, or None if the MAC is not in the export file.
+    def read_block(self, site, mac, known_digest=None):
+        with self.lock:
+            state = self.site_indexes.get(site)
+            if state is None:
+                state = self.site_indexes[site] = [ExportIndex(get_site_paths(site, self.base_directory)[0]), threading.Lock(), None]
+        index, lock, checked_at = state
+        with lock:
+            if checked_at is None:
+                index.load(save=False)
+            elif time.monotonic() - checked_at >= provisioning_refresh_interval:
+                index.update()
+            state[2] = time.monotonic()
+            block_entry = index.blocks.get(mac)
+            if block_entry is None:
+                return None
+            if block_entry[2] == known_digest:
+                return known_digest, None
+            return block_entry[2], index.read_block(mac)
+
+    # Function to get the entry [site, digest, body, checked_at] of a MAC, rendering its config if
+    # it is not cached or its block changed. Returns None for a MAC that is not provisioned.
+    def get(self, mac):
+        entry = self.get_fresh(mac)
+        if entry is not None:
+            return entry
+        site = self.find_site(mac)
+        if site is None:
+            return None
+        with self.lock:
+            entry = self.entries.get(mac)
+        known_digest = entry[1] if entry is not None and entry[0] == site else None
+        found = self.read_block(site, mac, known_digest)
+        if found is None:
+            return None
+        digest, block = found
+        if block is None:
+            entry[3] = time.monotonic()
+            with self.lock:
+                self.hits += 1
+        else:
+            entry = [site, digest, render_provisioning_xml(mac, block, self.ucm_ip), time.monotonic()]
+            with self.lock:
+                self.renders += 1
+        with self.lock:
+            self.entries[mac] = entry
+            self.entries.move_to_end(mac)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+        return entry
+
+# Function to check an If-None-Match header against the ETag of a response
+def etag_matches(if_none_match, etag):
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+# Function to run the provisioning server on host and port until it is interrupted. GET or HEAD of
+# cfg<MAC>.xml (or cfg<MAC>) in any folder answers the device's config as a Grandstream XML file, so
+# sites provisioned with --file-url http://<host>:<port>/ have their phones fetch it from here. Configs
+# are rendered from the export files on the first request and kept in a ProvisioningCache; the ETag
+# is the digest of the device's block, so a phone sending it back in If-None-Match gets 304 until its
+# config changes. Every fetch is logged and appended to kgzcfg/provisioning-log.csv. Cache misses run
+# in the threads of the default executor, so a whole floor of phones rebooting at once never holds up
+# the phones whose configs are already cached.
+def serve_provisioning(host, port, base_directory=None, ucm_ip="", log=print):
+    import asyncio
+
+    directory = os.path.abspath(base_directory or os.getcwd())
+    cache = ProvisioningCache(directory, ucm_ip)
+    fetch_log_path = os.path.join(directory, "kgzcfg", "provisioning-log.csv")
+    fetches = []
+    fetched_macs = set()
+
+    # Function to append the fetches logged since the last call to the fetch log
+    def write_fetch_log():
+        lines = fetches[:]
+        del fetches[:len(lines)]
+        if not lines:
+            return
+        os.makedirs(os.path.dirname(fetch_log_path), exist_ok=True)
+        new_file = not os.path.exists(fetch_log_path)
+        with open(fetch_log_path, "a", newline="") as file:
+            if new_file:
+                file.write("Time,Client,MAC Address,Site,Status\r\n")
+            file.writelines(lines)
+
+    # Function to build a provisioning response, with the body left out for HEAD
+    def response(status, method, body=b"", etag="", keep_alive=True):
+        head = f"HTTP/1.1 {status} {http_reasons[status]}\r\n"
+        if etag:
+            head += f'ETag: {etag}\r\nCache-Control: no-cache\r\n'
+        if status != 304:
+            head += f"Content-Type: {'application/xml' if status == 200 else 'text/plain'}\r\nContent-Length: {len(body)}\r\n"
+        head += f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+        return head.encode() + (body if method == "GET" and status != 304 else b"")
+
+    async def serve():
+        loop = asyncio.get_running_loop()
+
+        # Function to answer one config request, returning the response and the site of the MAC
+        async def provision(method, mac, headers, keep_alive):
+            entry = cache.get_fresh(mac)
+            if entry is None:
+                try:
+                    entry = await loop.run_in_executor(None, cache.get, mac)
+                except Exception as error:
+                    log(f"Failed to render the config of {mac}: {error}")
+                    return response(500, method, b"The config could not be rendered.\n", keep_alive=keep_alive), ""
+            if entry is None:
+                return response(404, method, b"No config for this MAC address.\n", keep_alive=keep_alive), ""
+            site, digest, body = entry[:3]
+            etag = f'"{digest}"'
+            status = 304 if etag_matches(headers.get("if-none-match", ""), etag) else 200
+            return response(status, method, body, etag, keep_alive), site
+
+        async def handle_connection(reader, writer):
+            client = (writer.get_extra_info("peername") or ("",))[0]
+            try:
+                while True:
+                    try:
+                        request = await read_http_request(reader)
+                    except HttpError as error:
+                        writer.write(response(error.status, "GET", f"{error}\n".encode(), keep_alive=False))
+                        break
+                    if request is None:
+                        break
+                    method, path, headers, body, keep_alive = request
+                    match = provisioning_path_pattern.match(path)
+                    if method not in ("GET", "HEAD"):
+                        writer.write(response(405, "GET", f"No {method} here.\n".encode(), keep_alive=keep_alive))
+                    elif match is None:
+                        writer.write(response(404, method, b"Not a device config file.\n", keep_alive=keep_alive))
+                    else:
+                        mac = match.group(1).upper()
+                        data, site = await provision(method, mac, headers, keep_alive)
+                        writer.write(data)
+                        status = data[9:12].decode()
+                        fetches.append(f"{time.strftime('%Y-%m-%d %H:%M:%S')},{client},{mac},{site},{status}\r\n")
+                        if status in ("200", "304"):
+                            fetched_macs.add(mac)
+                        log(f"{client} fetched the config of {mac}{f' of site {site}' if site else ''}: {status}")
+                    await writer.drain()
+                    if not keep_alive:
+                        break
+            except (asyncio.IncompleteReadError, ConnectionError):
+                pass
+            finally:
+                writer.close()
+
+        # Function to write the fetch log every provisioning_log_interval, away from the event loop
+        async def flush_fetch_log():
+            while True:
+                await asyncio.sleep(provisioning_log_interval)
+                if fetches:
+                    await loop.run_in_executor(None, write_fetch_log)
+
+        server = await asyncio.start_server(handle_connection, host, port, backlog=1024)
+        log(f"Serving device configs on http://{host}:{port}/cfg<MAC>.xml")
+        flusher = asyncio.create_task(flush_fetch_log())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            flusher.cancel()
+
+    if threading.current_thread() is threading.main_thread():
+        # Stop on SIGTERM like on Ctrl+C, so the last fetches are written to the fetch log
+        import signal
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        asyncio.run(serve())
+    finally:
+        write_fetch_log()
+        log(f"{len(fetched_macs)} devices fetched their config, {cache.renders} configs rendered and {cache.hits} served from the cache.")
@@ -0,0 +1,25 @@
+from kgzcfglib import AccountPool, iter_deployment_records, get_site_paths, run_site, silent_log
+
+def test_zero_padded_ranges_keep_their_width():
+    pool = AccountPool.from_expression("0098-0102,!0100,2000")
+    assert list(pool) == ["0098", "0099", "0101", "0102", 2000]
+    assert pool[2] == "0101"
+    assert str(pool) == "0098-0099,0101-0102,2000"
+    assert str(pool.take(3)) == "0098-0099,0101"
+
+def test_account_file_keeps_zero_padding(tmp_path):
+    macs = ["00D0D0000001", "00D0D0000002", "00D0D0000003"]
+    paths = get_site_paths("lab", str(tmp_path))
+    (tmp_path / "kgzcfg" / "lab").mkdir(parents=True)
+    with open(paths[3], "w") as file:
+        file.write("0101\n0102-0103\n")
+    run_site("lab", macs, "GRP2601P", "10.0.0.2", 1, base_directory=str(tmp_path), log=silent_log)
+    assert [account for mac, account, ip in iter_deployment_records(paths[2])] == ["0101", "0102", "0103"]
+    with open(paths[0]) as file:
+        assert "00D0D0000001,Account,1,AccountChoice,0101\n" in file.read()
+
+def test_zero_padded_starting_account(tmp_path):
+    run_site("lab", ["00D0D0000001", "00D0D0000002"], "GRP2601P", "10.0.0.2", 1, start_account="0099",
+             base_directory=str(tmp_path), log=silent_log)
+    deployment_path = get_site_paths("lab", str(tmp_path))[2]
+    assert [account for mac, account, ip in iter_deployment_records(deployment_path)] == ["0099", "0100"]
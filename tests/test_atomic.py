@@ -0,0 +1,45 @@
+import os
+
+import pytest
+
+import kgzcfglib
+from kgzcfglib import run_site, silent_log
+
+macs = [f"00C0C00000{number:02X}" for number in range(1, 11)]
+
+# Function to provision the static site "lab" under base_directory, returning the run summary
+def provision(base_directory, **options):
+    return run_site("lab", macs, "GRP2601P", "10.0.0.2", 2, start_ip="10.1.0.10", start_account=1000,
+                    base_directory=str(base_directory), log=silent_log, **options)
+
+def read_file(path):
+    with open(path, "rb") as file:
+        return file.read()
+
+def test_interrupted_atomic_run_resumes(tmp_path, monkeypatch):
+    monkeypatch.setattr(kgzcfglib, "write_chunk_devices", 2)
+    clean_directory, atomic_directory = tmp_path / "clean", tmp_path / "atomic"
+    provision(clean_directory)
+
+    # Interrupt the run halfway through, after some chunks were checkpointed
+    written = []
+    def interrupt(mac, account, ip):
+        written.append(mac)
+        if len(written) == 5:
+            raise KeyboardInterrupt
+    with pytest.raises(KeyboardInterrupt):
+        provision(atomic_directory, atomic=True, on_device=interrupt)
+    paths = kgzcfglib.get_site_paths("lab", str(atomic_directory))
+    export_path, deployment_path, mac_index_path, journal_path = paths[0], paths[2], paths[4], paths[7]
+    assert kgzcfglib.read_journal(journal_path)["devices"] > 0
+    assert not os.path.exists(export_path) or os.path.getsize(export_path) == 0
+
+    result = provision(atomic_directory, atomic=True)
+    assert 0 < result["devices"] < len(macs)  # Only the devices after the last checkpoint are written again
+    clean_paths = kgzcfglib.get_site_paths("lab", str(clean_directory))
+    assert read_file(export_path) == read_file(clean_paths[0])
+    assert read_file(deployment_path) == read_file(clean_paths[2])
+    assert not os.path.exists(journal_path)
+    assert not any(name.endswith(".part") for name in os.listdir(os.path.dirname(export_path)))
+    mac_index = kgzcfglib.open_mac_index(mac_index_path, read_only=True)
+    assert set(kgzcfglib.lookup_provisioned_macs(mac_index, macs)) == set(map(kgzcfglib.mac_to_int, macs))
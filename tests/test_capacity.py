@@ -0,0 +1,18 @@
+import os
+
+import pytest
+
+from kgzcfglib import KgzcfgError, run_site, silent_log
+
+macs = ["00E0E0000001", "00E0E0000002", "00E0E0000003"]
+
+def test_too_few_accounts_creates_nothing(tmp_path):
+    with pytest.raises(KgzcfgError):
+        run_site("lab", macs, "GRP2601P", "10.0.0.2", 1, accounts="1000-1001", base_directory=str(tmp_path), log=silent_log)
+    assert not os.path.exists(tmp_path / "kgzcfg")
+
+def test_subnet_too_small_creates_nothing(tmp_path):
+    with pytest.raises(KgzcfgError):
+        run_site("lab", macs, "GRP2601P", "10.0.0.2", 2, start_ip="10.1.0.253", start_account=1000,
+                 base_directory=str(tmp_path), log=silent_log)
+    assert not os.path.exists(tmp_path / "kgzcfg")
@@ -0,0 +1,73 @@
+import kgzcfglib
+from kgzcfglib import ExportIndex, ProvisioningCache, run_site, silent_log
+
+macs = ["00B0B0000001", "00B0B0000002", "00B0B0000003"]
+
+# Function to provision the static site "lab" under base_directory, returning its export file path
+def provision(base_directory, mac_addresses=macs, dns_ip="8.8.8.8", upsert=False):
+    run_site("lab", mac_addresses, "GRP2601P", "10.0.0.2", 2, start_ip="10.1.0.10", dns_ip=dns_ip, start_account=1000,
+             upsert=upsert, base_directory=str(base_directory), log=silent_log)
+    return kgzcfglib.get_site_paths("lab", str(base_directory))[0]
+
+def test_same_size_upsert_of_an_earlier_block_is_seen(tmp_path):
+    export_path = provision(tmp_path)
+    index = ExportIndex(export_path).load(save=False)
+    old_digest = index.blocks[macs[0]][2]
+    size = index.size
+
+    # Same length DNS server, only the first device's block is rewritten
+    provision(tmp_path, macs[:1], dns_ip="1.1.1.1", upsert=True)
+    assert index.update()
+    assert index.size == size
+    assert index.blocks[macs[0]][2] != old_digest
+    assert b"DNSServer1_1,1" in index.read_block(macs[0])
+
+def test_provisioning_cache_serves_the_upserted_config(tmp_path, monkeypatch):
+    monkeypatch.setattr(kgzcfglib, "provisioning_refresh_interval", 0)
+    provision(tmp_path)
+    cache = ProvisioningCache(str(tmp_path), "10.0.0.2")
+    site, old_digest, old_body = cache.get(macs[0])[:3]
+    assert b"<P21>8</P21>" in old_body
+
+    provision(tmp_path, macs[:1], dns_ip="1.1.1.1", upsert=True)
+    site, digest, body = cache.get(macs[0])[:3]
+    assert digest != old_digest
+    assert b"<P21>1</P21>" in body
+
+def test_partial_trailing_block_is_indexed_once_complete(tmp_path):
+    export_path = provision(tmp_path)
+    with open(export_path, "rb") as file:
+        data = file.read()
+    # Cut in the middle of the last device's rows, as a refresh may see a block being appended
+    cut = len(data) - 10
+    with open(export_path, "wb") as file:
+        file.write(data[:cut])
+    index = ExportIndex(export_path).load(save=False)
+    assert macs[2] not in index
+    assert index.blocks[macs[1]][0] + index.blocks[macs[1]][1] == index.size
+
+    with open(export_path, "ab") as file:
+        file.write(data[cut:])
+    assert index.update()
+    assert index.size == len(data)
+    assert index.read_block(macs[2]) == data[index.blocks[macs[2]][0]:]
+    assert index.duplicates == 0
+
+def test_block_cut_after_a_section_is_repaired(tmp_path):
+    export_path = provision(tmp_path)
+    with open(export_path, "rb") as file:
+        data = file.read()
+    # Cut right after the last device's basic settings, which looks like a complete DHCP block
+    cut = data.rindex(kgzcfglib.advanced_settings_title.encode())
+    with open(export_path, "wb") as file:
+        file.write(data[:cut])
+    index = ExportIndex(export_path).load(save=False)
+    assert index.blocks[macs[2]][0] + index.blocks[macs[2]][1] == cut
+
+    with open(export_path, "ab") as file:
+        file.write(data[cut:])
+    assert index.update()
+    full = ExportIndex(export_path)
+    full.update()
+    assert index.blocks == full.blocks
+    assert index.duplicates == 0
@@ -0,0 +1,72 @@
+import kgzcfglib
+from kgzcfglib import ExportIndex, run_site, silent_log
+
+macs = ["00B0B0000001", "00B0B0000002", "00B0B0000003", "00B0B0000004"]
+
+# Function to provision the static site "lab" under base_directory, returning the run summary
+def provision(base_directory, mac_addresses=macs, dns_ip="8.8.8.8", **options):
+    return run_site("lab", mac_addresses, "GRP2601P", "10.0.0.2", 2, start_ip="10.1.0.10", dns_ip=dns_ip, start_account=1000,
+                    base_directory=str(base_directory), log=silent_log, **options)
+
+# Function to read the blocks of an export file in order as (mac, block) pairs
+def read_blocks(export_path):
+    with open(export_path, "rb") as file:
+        return [(mac, block) for mac, offset, block in kgzcfglib.iter_export_blocks(file)]
+
+# Function to check that the sidecar index of an export file matches an index built from scratch
+def assert_index_matches_file(export_path):
+    saved = ExportIndex(export_path).load(save=False)
+    fresh = ExportIndex(export_path)
+    fresh.update()
+    assert saved.blocks == fresh.blocks
+    assert saved.size == fresh.size
+
+def upsert_middle_device(tmp_path, dns_ip):
+    provision(tmp_path)
+    export_path = kgzcfglib.get_site_paths("lab", str(tmp_path))[0]
+    before = read_blocks(export_path)
+    result = provision(tmp_path, macs[1:2], dns_ip=dns_ip, upsert=True)
+    assert (result["new"], result["changed"], result["unchanged"]) == (0, 1, 0)
+    after = read_blocks(export_path)
+    assert [mac for mac, block in after] == macs
+    # Only the middle device's block is rewritten, in place
+    for (mac, old_block), (_, new_block) in zip(before, after):
+        if mac == macs[1]:
+            assert new_block != old_block
+            assert f"DNSServer1_1,{dns_ip.split('.')[0]}\r\n".encode() in new_block
+        else:
+            assert new_block == old_block
+    with open(export_path, "rb") as file:
+        assert file.read() == b"".join(block for mac, block in after)
+    assert_index_matches_file(export_path)
+    return before, after
+
+def test_upsert_of_a_middle_block_that_grows(tmp_path):
+    before, after = upsert_middle_device(tmp_path, "10.10.10.10")
+    assert len(after[1][1]) > len(before[1][1])
+
+def test_upsert_of_a_middle_block_of_the_same_size(tmp_path):
+    before, after = upsert_middle_device(tmp_path, "1.1.1.1")
+    assert len(after[1][1]) == len(before[1][1])
+
+def test_upsert_drops_superseded_blocks(tmp_path):
+    provision(tmp_path, macs[:2])
+    # Re-provisioning appends a second block for the same device
+    provision(tmp_path, macs[:1], reprovision=True)
+    export_path = kgzcfglib.get_site_paths("lab", str(tmp_path))[0]
+    assert [mac for mac, block in read_blocks(export_path)] == [macs[0], macs[1], macs[0]]
+
+    result = provision(tmp_path, macs[:3], dns_ip="10.10.10.10", upsert=True)
+    assert result["new"] == 1
+    assert [mac for mac, block in read_blocks(export_path)] == [macs[1], macs[0], macs[2]]
+    assert_index_matches_file(export_path)
+
+def test_upsert_reports_every_rewritten_block(tmp_path):
+    provision(tmp_path, macs[:2])
+    blocks = {}
+    def keep_block(mac, account, ip, block):
+        blocks[mac] = block
+    result = provision(tmp_path, macs[:3], dns_ip="10.10.10.10", upsert=True, on_block=keep_block)
+    assert (result["new"], result["changed"], result["devices"]) == (1, 2, 3)
+    export_path = kgzcfglib.get_site_paths("lab", str(tmp_path))[0]
+    assert {mac: block.encode() for mac, block in blocks.items()} == dict(read_blocks(export_path))